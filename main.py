@@ -1,19 +1,32 @@
 import logging
 from fastapi import FastAPI, File, HTTPException
-from pydantic import BaseModel
-from typing import Annotated
-from fastapi import FastAPI, UploadFile, Form, Request
+from pydantic import BaseModel, Field
+from typing import Annotated, Literal, Optional
+from fastapi import FastAPI, UploadFile, Form, Request, Response, Depends, Query
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from langchain.llms.cohere import Cohere
-from langchain.document_loaders import PyPDFLoader
 from dotenv import load_dotenv
-import shutil
-import weaviate
-from langchain.vectorstores import Weaviate
-from utils.weaviate import wv_upload_doc, wv_create_class
-from utils.weaviate import ask_question
+
+# load .env before importing utils, which read their settings at import time
+load_dotenv()
+
+from utils.weaviate import wv_create_class, wv_delete_class
+from utils.weaviate import create_retrieval_client, create_wv_client, physical_class, schema_registry
+from utils.weaviate import PROMPTS, chain_pool, get_chain, run_chain
+from utils.langid import detect_language
 from utils import db
-from utils.africastalking import AfricasTalking
+from utils import async_db
+from utils.senders import registered_senders, start_refresh
+from utils.answer_cache import answer_cache
+from utils.embedding_cache import get_embedding_cache
+from utils.sms_worker import SmsWorkerPool
+from utils.sessions import create_session_store
+from utils.phone import normalize_number
+from utils import outbound
+from utils.ingest import IngestJobs, shutdown_process_pool, spool_upload
+from utils.migrations import report_schema
+import json
 import urllib.parse
 from werkzeug.security import check_password_hash
 import os
@@ -22,7 +35,6 @@ import os
 # db.init_db()
 # db.insert_dummy_data()
 
-load_dotenv()
 app = FastAPI()
 origins = [
     "http://localhost",
@@ -37,14 +49,76 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
-wv_client = weaviate.Client(
-    url=os.environ.get("WEAVIATE_URL"),
-    auth_client_secret=weaviate.AuthApiKey(api_key=os.environ.get("WEAVIATE_API_KEY")),
-    additional_headers={"X-Cohere-Api-Key": os.environ.get("COHERE_API_KEY")},
+wv_client = create_wv_client()
+# Answer time searches time out after RETRIEVAL_TIMEOUT
+retrieval_client = create_retrieval_client()
+
+ingest_jobs = IngestJobs(
+    create_wv_client,
+    max_workers=int(os.environ.get("INGEST_MAX_CONCURRENCY", 2)),
 )
 
+
+# SMS_WORKERS > 0 answers /sms in the background instead of inside the request
+sms_workers = None
+dispatcher = None
+sessions = None
+
+
+@app.on_event("startup")
+def startup():
+    global sms_workers, dispatcher, sessions
+    report_schema()
+    sessions = create_session_store()
+    try:
+        registered_senders.load(db.get_registered_numbers())
+        print(f"Loaded {len(registered_senders)} registered numbers")
+    except Exception as e:
+        # confirm_phone_number falls back to querying the database
+        logging.error(f"Could not load registered numbers: {e}")
+    refresh_interval = float(os.environ.get("SENDER_CACHE_REFRESH_SECONDS", 300))
+    if refresh_interval > 0:
+        start_refresh(db.get_registered_numbers, refresh_interval)
+
+    workers = int(os.environ.get("SMS_WORKERS", 0))
+    if workers > 0:
+        sms_workers = SmsWorkerPool(
+            answer_sms,
+            workers=workers,
+            queue_size=int(os.environ.get("SMS_QUEUE_SIZE", 1000)),
+        )
+        sms_workers.start()
+
+    if outbound.queue_enabled():
+        if os.environ.get("OUTBOUND_DISPATCHER", "1") == "1":
+            dispatcher = outbound.OutboundDispatcher(
+                rate=float(os.environ.get("OUTBOUND_RATE", 10)),
+                burst=int(os.environ.get("OUTBOUND_BURST", 100)),
+                batch_size=int(os.environ.get("OUTBOUND_BATCH_SIZE", 500)),
+                max_attempts=int(os.environ.get("OUTBOUND_MAX_ATTEMPTS", 5)),
+            )
+            dispatcher.start()
+
+
+@app.on_event("shutdown")
+async def close_async_db():
+    await async_db.close_pool()
+
+
+@app.on_event("shutdown")
+def shutdown():
+    if sms_workers is not None:
+        sms_workers.stop()
+    if dispatcher is not None:
+        dispatcher.stop()
+    ingest_jobs.shutdown()
+    shutdown_process_pool()
+    db.close_pool()
+
+
 class LoginOrganization(BaseModel):
     email: str
     password: str
@@ -62,6 +136,41 @@ class ShortCode(BaseModel):
     organization_id: int
 
 
+class RetrievalSettings(BaseModel):
+    retrieval_k: Optional[int] = Field(None, ge=1, le=20)
+    context_tokens: Optional[int] = Field(None, ge=50, le=4000)
+    language: Optional[str] = None
+
+
+class Page:
+    """Keyset pagination for list endpoints: pass the previous response's
+    X-Next-Cursor header as `cursor`; format=ndjson streams every row."""
+
+    def __init__(
+        self,
+        cursor: Optional[int] = None,
+        limit: int = Query(db.PAGE_SIZE, ge=1, le=1000),
+        format: Literal["json", "ndjson"] = "json",
+    ):
+        self.cursor = cursor
+        self.limit = limit
+        self.format = format
+
+
+def set_next_cursor(response, next_cursor):
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+
+
+def ndjson_response(rows):
+    # rows is a generator from db or an async generator from async_db
+    if hasattr(rows, "__aiter__"):
+        lines = async_db.ndjson_lines(rows)
+    else:
+        lines = (json.dumps(row, default=str) + "\n" for row in rows)
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+
 class FileInfo(BaseModel):
     file_id: int
 
@@ -123,10 +232,9 @@ async def create_upload_file(organization: str, file: UploadFile = Form(...), sh
     wv_class_name = f"{organization}_{file.filename.split('.')[0]}".replace(
         " ", ""
     ).replace("-", "")
-    classes = [row["class"].upper() for row in wv_client.schema.get()["classes"]]
 
     # DB Operations
-    added_file = db.add_file(
+    added_file = await async_db.add_file(
         {
             "name": file.filename,
             "organization": organization,
@@ -134,42 +242,73 @@ async def create_upload_file(organization: str, file: UploadFile = Form(...), sh
         }
     )
     if added_file:
-        added_shortcode = db.add_short_code(shortcode, organization_id)
+        added_shortcode = await async_db.add_short_code(shortcode, organization_id)
         if added_shortcode:
-            db.add_file_to_short_code(shortcode, file.filename)
-
-    if wv_class_name.upper() not in classes:
-        wv_create_class(wv_client, wv_class_name)
-        try:
-            if not os.path.exists("uploads"):
-                os.mkdir("uploads")
-
-            with open(f"uploads/{file.filename}", "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-            loader = PyPDFLoader(f"uploads/{file.filename}")
-            doc = loader.load()
-            wv_upload_doc(wv_client, doc, wv_class_name) #################
-
-        except ValueError:
-            return {"message": f"file: {file.filename} was not uploaded to server"}
-        except AttributeError:
-            return {"message": f"File: {file.filename} was not uploaded to weaviate"}
-        finally:
-            file.file.close()
-    else:
-        return {"msg": "File already exists"}
-    # return added_file
-    return {}
+            await async_db.add_file_to_short_code(shortcode, file.filename)
+    # Answers given for this shortcode or class may change with the new file,
+    # both now and again once its chunks have been ingested
+    def invalidate_answers(job=None):
+        answer_cache.invalidate_shortcode(shortcode)
+        answer_cache.invalidate_class(wv_class_name)
+
+    invalidate_answers()
+
+    # Re-uploading an existing file only re-indexes the chunks that changed
+    # Weaviate and file I/O still block, so they run in the threadpool
+    if not await run_in_threadpool(
+        schema_registry.exists, wv_client, physical_class(wv_class_name)
+    ):
+        await run_in_threadpool(wv_create_class, wv_client, wv_class_name)
+    try:
+        # Spool to a temp file and ingest it in the background
+        path = await run_in_threadpool(spool_upload, file.file)
+        job = ingest_jobs.submit(
+            path,
+            wv_class_name,
+            file.filename,
+            {
+                "organization": organization,
+                "organization_id": int(organization_id) if organization_id.isdigit() else None,
+                "file": file.filename,
+                "shortcode": shortcode,
+            },
+            on_done=invalidate_answers,
+        )
+        return {"job_id": job.id, "status": job.status}
+
+    except ValueError:
+        return {"message": f"file: {file.filename} was not uploaded to server"}
+    except AttributeError:
+        return {"message": f"File: {file.filename} was not uploaded to weaviate"}
+    finally:
+        file.file.close()
+
+@app.get("/ingest/{job_id}")
+def get_ingest_job(job_id: str):
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
 
-@app.post("organizations/{organization}/deletefile")
+@app.post("/organizations/{organization}/deletefile")
 async def delete_files(organization: str, filename: str):
-    wv_client.schema.delete_class()
-    return {"message": f"{organization}_{filename.split('.')[0]}"}
+    wv_class_name = f"{organization}_{filename.split('.')[0]}".replace(
+        " ", ""
+    ).replace("-", "")
+    await run_in_threadpool(wv_delete_class, wv_client, wv_class_name)
+    answer_cache.invalidate_class(wv_class_name)
+    return {"message": wv_class_name}
 
 
 @app.get("/{organization_id}/files")
-async def get_short_codes(organization_id: int):
-    results = db.get_files(organization_id)
+async def get_short_codes(organization_id: int, response: Response, page: Page = Depends()):
+    if page.format == "ndjson":
+        return ndjson_response(
+            await async_db.get_files(organization_id, page.cursor, stream=True)
+        )
+    results, next_cursor = await async_db.get_files(organization_id, page.cursor, page.limit)
+    set_next_cursor(response, next_cursor)
     return results
 
 
@@ -180,54 +319,113 @@ def register_short_code(short_code: ShortCode, organization: str):
 
 
 @app.get("/{organization}/shortcodes")
-async def get_short_codes(organization: str):
-    results = db.get_short_codes(organization)
+async def get_short_codes(organization: str, response: Response, page: Page = Depends()):
+    if page.format == "ndjson":
+        return ndjson_response(
+            await async_db.get_short_codes(organization, page.cursor, stream=True)
+        )
+    results, next_cursor = await async_db.get_short_codes(
+        organization, page.cursor, page.limit
+    )
+    set_next_cursor(response, next_cursor)
     return {"short_codes": results}
 
 
+@app.post("/{organization}/shortcode/{short_code}/retrieval")
+def update_short_code_retrieval(organization: str, short_code: str, settings: RetrievalSettings):
+    if settings.language is not None and settings.language not in PROMPTS:
+        raise HTTPException(
+            status_code=400, detail=f"language must be one of {', '.join(PROMPTS)}"
+        )
+    updated = db.update_short_code_settings(
+        short_code, settings.retrieval_k, settings.context_tokens, settings.language
+    )
+    answer_cache.invalidate_shortcode(short_code)
+    return {"shortcode": updated}
+
+
 @app.get("/{organization}/shortcode/{id}/delete")
 def register_short_code(id):
     removed_short_code = db.delete_short_code(id)
     return {"removed": removed_short_code}
 
 
+def answer_sms(shortcode, sender_number, question):
+    if not db.confirm_phone_number(sender_number):
+        outbound.send_sms(
+            shortcode,
+            """Sorry, your number is not registered in our system. Kindly reach out to us at info@connectedai.net if you want your number to be registered on our system.""",
+            [sender_number],
+        )
+        return {"message": "Number not registered"}
+
+    try:
+        conversation = f"{shortcode}:{normalize_number(sender_number)}"
+    except ValueError:
+        conversation = f"{shortcode}:{sender_number}"
+    chat_history = sessions.get(conversation)
+    result = db.get_short_code(shortcode)
+    if result and question:
+        # Answer from every file attached to the shortcode
+        classes = [row["weaviate_class"] for row in result]
+        settings = result[0]
+        # Pick the prompts for the question's language, falling back to
+        # the shortcode's default when detection isn't confident
+        lang = detect_language(question, settings.get("language"))
+        answer, vector = None, None
+        # Follow ups depend on the conversation, so only first questions are cached
+        if not chat_history:
+            answer, vector = answer_cache.lookup(shortcode, question, lang)
+        if answer is None:
+            qa = get_chain(
+                retrieval_client,
+                classes,
+                lang,
+                k=settings.get("retrieval_k"),
+                token_budget=settings.get("context_tokens"),
+            )
+            follow_up = bool(chat_history)
+            answer = run_chain(qa, question, chat_history)
+            if not follow_up:
+                answer_cache.store(
+                    shortcode,
+                    question,
+                    answer,
+                    classes,
+                    lang,
+                    vector=vector,
+                )
+        sessions.append(conversation, question, answer)
+        outbound.send_sms(shortcode, answer, [sender_number])
+        return {"answer": answer}
+    else:
+        outbound.send_sms(
+            shortcode,
+            "Sorry we are having a technical issue. Try again later",
+            [sender_number],
+        )
+
+
 @app.post("/sms")
 async def receive_sms(request: Request):
     try:
         decoded_string = await request.body()
         parsed_dict = urllib.parse.parse_qs(decoded_string.decode("utf-8"))
-        chat_history = []
-        
-        # phone_numbers = db.get_phone_numbers()
-        sender_number = parsed_dict["from"][0] 
-        
-        if not db.confirm_phone_number(sender_number):
-            AfricasTalking().send(
-                parsed_dict["to"][0],
-                """Sorry, your number is not registered in our system. Kindly reach out to us at info@connectedai.net if you want your number to be registered on our system.""",
-                [sender_number],
-            )
-            return {"message": "Number not registered"}
-        
-        result = db.get_short_code(parsed_dict["to"][0])
-        if result and parsed_dict["text"][0]:
-            vectorstore = Weaviate(wv_client, result["weaviate_class"], "content")
-            answer = ask_question(
-                vectorstore,
-                Cohere(temperature=0), 
-                parsed_dict["text"][0],
-                chat_history,
-            )
-            classes = [row["class"].upper() for row in wv_client.schema.get()["classes"]]
-            AfricasTalking().send(parsed_dict["to"][0], answer, [parsed_dict["from"][0]])
-            return {"answer": answer}
-        else:
-            AfricasTalking().send(
-                parsed_dict["to"][0],
-                "Sorry we are having a technical issue. Try again later",
-                [parsed_dict["from"][0]],
-            )
-    
+        shortcode = parsed_dict["to"][0]
+        sender_number = parsed_dict["from"][0]
+        question = parsed_dict.get("text", [""])[0]
+    except (KeyError, IndexError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid SMS payload")
+
+    if sms_workers is not None:
+        # Acknowledge at once and answer from the worker pool
+        if not sms_workers.submit(shortcode, sender_number, question):
+            raise HTTPException(status_code=503, detail="SMS queue is full")
+        return {"message": "Queued"}
+
+    try:
+        # Keep the blocking DB, Weaviate, Cohere and SMS calls off the event loop
+        return await run_in_threadpool(answer_sms, shortcode, sender_number, question)
     except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
@@ -235,43 +433,83 @@ async def receive_sms(request: Request):
 @app.post("/{organization}/message/add")
 def add_message(message: Message, organization: str):
     try:
-        # numbers = [row["numbers"].split(",") for row in db.get_phone_numbers()]
-        numbers = db.get_phone_numbers()
-        # all_numbers = []
+        # Only numbers in the selected areas, deduplicated across areas
+        numbers = db.get_area_phone_numbers(message.areas)
+        if not numbers:
+            raise HTTPException(status_code=404, detail="No phone numbers found for the selected areas")
 
-        # for nums in numbers:
-        #     all_numbers = [*all_numbers.strip(), *nums.strip()]
-        # # print(all_numbers)
-        print(numbers)
-        AfricasTalking().send(message.shortcode, message.content, numbers)
+        chunks, sms = outbound.broadcast(message.shortcode, message.content, numbers)
+        if not any(chunk["status"] in ("sent", "queued") for chunk in chunks):
+            raise HTTPException(status_code=500, detail="Failed to send message")
 
         db.add_message(
-            message.content, organization, message.shortcode, message.areas
+            message.content,
+            organization,
+            message.shortcode,
+            message.areas,
+            sms["segments"],
+            sms["encoding"],
         )
-        
+        return {"recipients": len(numbers), "chunks": chunks, "segments": sms["segments"]}
+
+    except HTTPException:
+        raise
     except Exception as e:
-        # numbers = [row["numbers"].split(",") for row in db.get_phone_numbers()]
-        numbers = db.get_phone_numbers()
-        print(numbers)
-        # print(all_numbers)
+        logging.error(f"Failed to send message: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to send message")
 
 
 @app.get("/{organization}/messages/")
-def get_messages(organization: str):
+def get_messages(organization: str, response: Response, page: Page = Depends()):
     if organization != "":
-        results = db.get_messages(organization)
+        if page.format == "ndjson":
+            return ndjson_response(db.get_messages(organization, page.cursor, stream=True))
+        results, next_cursor = db.get_messages(organization, page.cursor, page.limit)
+        set_next_cursor(response, next_cursor)
         return results
     else:
         return {"msg": "Organization not provided"}
 
 
 @app.get("/areas")
-def get_areas():
-    areas = db.get_areas()
+def get_areas(response: Response, page: Page = Depends()):
+    if page.format == "ndjson":
+        return ndjson_response(db.get_areas(page.cursor, stream=True))
+    areas, next_cursor = db.get_areas(page.cursor, page.limit)
+    set_next_cursor(response, next_cursor)
     return areas
 
 
+@app.get("/areas/{area_id}/numbers")
+def get_area_numbers(area_id: int, response: Response, page: Page = Depends()):
+    if page.format == "ndjson":
+        return ndjson_response(db.get_area_numbers(area_id, page.cursor, stream=True))
+    numbers, next_cursor = db.get_area_numbers(area_id, page.cursor, page.limit)
+    set_next_cursor(response, next_cursor)
+    return numbers
+
+
+@app.get("/outbound/stats")
+def get_outbound_stats():
+    if not outbound.queue_enabled():
+        return {"msg": "Outbound queue disabled", "segments": outbound.segment_stats.stats()}
+    return {**db.get_sms_queue_stats(), "segments": outbound.segment_stats.stats()}
+
+
+@app.get("/cache/stats")
+def get_cache_stats():
+    embedding_cache = get_embedding_cache()
+    return {
+        "short_codes": db.short_code_cache.stats(),
+        "senders": registered_senders.stats(),
+        "chains": chain_pool.stats(),
+        "answers": answer_cache.stats(),
+        "sms_workers": sms_workers.stats() if sms_workers else None,
+        "sessions": sessions.stats() if sessions else None,
+        "embeddings": embedding_cache.store.stats() if embedding_cache else None,
+    }
+
+
 # @app.get("/numbers")
 # async def get_numbers():
 #     try:
@@ -0,0 +1,45 @@
+-- The tables as first created by db.init_db, before versioned migrations.
+-- Existing databases already have them, so this is a no-op there.
+CREATE TABLE IF NOT EXISTS organizations
+(id SERIAL PRIMARY KEY,
+name TEXT NOT NULL UNIQUE,
+email TEXT NOT NULL UNIQUE,
+password TEXT NOT NULL,
+address TEXT NOT NULL,
+description TEXT NOT NULL);
+
+CREATE TABLE IF NOT EXISTS files
+(id SERIAL PRIMARY KEY,
+name TEXT NOT NULL,
+organization_id INTEGER NOT NULL,
+weaviate_class TEXT NOT NULL UNIQUE,
+UNIQUE (name, organization_id),
+FOREIGN KEY (organization_id) REFERENCES organizations(id));
+
+CREATE TABLE IF NOT EXISTS short_codes
+(id SERIAL PRIMARY KEY,
+short_code TEXT NOT NULL UNIQUE,
+organization_id INTEGER NOT NULL,
+UNIQUE (short_code, organization_id),
+FOREIGN KEY (organization_id) REFERENCES organizations(id));
+
+CREATE TABLE IF NOT EXISTS short_code_files
+(id SERIAL PRIMARY KEY,
+short_code_id INTEGER NOT NULL,
+file_id SERIAL NOT NULL,
+UNIQUE (short_code_id, file_id),
+FOREIGN KEY (file_id) REFERENCES files(id),
+FOREIGN KEY (short_code_id) REFERENCES short_codes(id));
+
+CREATE TABLE IF NOT EXISTS messages
+(id SERIAL PRIMARY KEY,
+content TEXT NOT NULL,
+shortcode_id INT NOT NULL,
+organization_id INTEGER NOT NULL,
+areas TEXT NOT NULL,
+FOREIGN KEY (organization_id) REFERENCES organizations(id));
+
+CREATE TABLE IF NOT EXISTS areas
+(id SERIAL PRIMARY KEY,
+name TEXT NOT NULL,
+numbers TEXT NOT NULL);
@@ -0,0 +1,46 @@
+"""Move numbers out of the comma separated areas.numbers column into
+phone_numbers, in E.164 form; invalid numbers are skipped with a warning."""
+import logging
+
+import psycopg2.extras
+
+from utils.phone import normalize_number
+
+
+def upgrade(cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS phone_numbers
+        (id SERIAL PRIMARY KEY,
+        area_id INTEGER NOT NULL REFERENCES areas(id) ON DELETE CASCADE,
+        e164_number TEXT NOT NULL,
+        UNIQUE (e164_number, area_id));
+        """
+    )
+    cursor.execute(
+        """
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'areas' AND column_name = 'numbers'
+        """
+    )
+    if not cursor.fetchone():
+        return
+    cursor.execute("SELECT id, numbers FROM areas")
+    rows = []
+    for area in cursor.fetchall():
+        for number in (area["numbers"] or "").split(","):
+            if not number.strip():
+                continue
+            try:
+                rows.append((area["id"], normalize_number(number)))
+            except ValueError:
+                logging.warning(f"Skipping invalid number '{number}' in area {area['id']}")
+    psycopg2.extras.execute_values(
+        cursor,
+        """
+        INSERT INTO phone_numbers (area_id, e164_number) VALUES %s
+        ON CONFLICT (e164_number, area_id) DO NOTHING
+        """,
+        rows,
+    )
+    cursor.execute("ALTER TABLE areas DROP COLUMN numbers")
@@ -0,0 +1,6 @@
+-- Per-shortcode answer settings and per-message segment counts
+ALTER TABLE short_codes ADD COLUMN IF NOT EXISTS retrieval_k INTEGER;
+ALTER TABLE short_codes ADD COLUMN IF NOT EXISTS context_tokens INTEGER;
+ALTER TABLE short_codes ADD COLUMN IF NOT EXISTS language TEXT;
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS segments INTEGER;
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS encoding TEXT;
@@ -0,0 +1,32 @@
+-- Outbound SMS jobs and their status history. Earlier releases created
+-- these tables at startup, without the segment and priority columns.
+CREATE TABLE IF NOT EXISTS outbound_sms
+(id SERIAL PRIMARY KEY,
+sender TEXT NOT NULL,
+message TEXT NOT NULL,
+recipients TEXT[] NOT NULL,
+status TEXT NOT NULL DEFAULT 'pending',
+attempts INTEGER NOT NULL DEFAULT 0,
+last_error TEXT,
+segments INTEGER,
+encoding TEXT,
+priority SMALLINT NOT NULL DEFAULT 0,
+next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+updated_at TIMESTAMPTZ NOT NULL DEFAULT now());
+
+ALTER TABLE outbound_sms ADD COLUMN IF NOT EXISTS segments INTEGER;
+ALTER TABLE outbound_sms ADD COLUMN IF NOT EXISTS encoding TEXT;
+ALTER TABLE outbound_sms ADD COLUMN IF NOT EXISTS priority SMALLINT NOT NULL DEFAULT 0;
+
+-- Replaces the startup-created index, which didn't lead with priority
+DROP INDEX IF EXISTS outbound_sms_pending_idx;
+CREATE INDEX IF NOT EXISTS outbound_sms_due_idx
+ON outbound_sms (priority, next_attempt_at) WHERE status IN ('pending', 'sending');
+
+CREATE TABLE IF NOT EXISTS outbound_sms_events
+(id SERIAL PRIMARY KEY,
+job_id INTEGER NOT NULL REFERENCES outbound_sms(id) ON DELETE CASCADE,
+status TEXT NOT NULL,
+detail TEXT,
+created_at TIMESTAMPTZ NOT NULL DEFAULT now());
@@ -0,0 +1,8 @@
+-- Per-sender conversation history for SESSION_BACKEND=postgres
+CREATE TABLE IF NOT EXISTS conversations
+(key TEXT PRIMARY KEY,
+turns BYTEA NOT NULL,
+updated_at TIMESTAMPTZ NOT NULL DEFAULT now());
+
+CREATE INDEX IF NOT EXISTS conversations_updated_at_idx
+ON conversations (updated_at);
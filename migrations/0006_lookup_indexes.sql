@@ -0,0 +1,18 @@
+-- Indexes for the /sms and dashboard lookups. Columns already covered by a
+-- primary key or the leading column of a UNIQUE constraint
+-- (short_codes.short_code, files.name, organizations.name/email,
+-- short_code_files.short_code_id, phone_numbers.e164_number) are left out.
+
+-- Case insensitive organization lookups: lower(name) = lower(%s)
+CREATE INDEX IF NOT EXISTS organizations_lower_name_idx ON organizations (lower(name));
+
+-- Dashboard listings, paged by id within an organization
+CREATE INDEX IF NOT EXISTS messages_organization_id_idx ON messages (organization_id, id);
+CREATE INDEX IF NOT EXISTS short_codes_organization_id_idx ON short_codes (organization_id, id);
+CREATE INDEX IF NOT EXISTS files_organization_id_idx ON files (organization_id);
+
+-- Joins from files and areas, and the foreign key side of deletes; an
+-- area's numbers are also counted and paged by id
+CREATE INDEX IF NOT EXISTS short_code_files_file_id_idx ON short_code_files (file_id);
+CREATE INDEX IF NOT EXISTS phone_numbers_area_id_idx ON phone_numbers (area_id, id);
+CREATE INDEX IF NOT EXISTS areas_name_idx ON areas (name);
@@ -1,4 +1,7 @@
+import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import africastalking
 from fastapi import HTTPException
@@ -21,3 +24,43 @@ class AfricasTalking:
         except Exception as e:
             print(f"Houston, we have a problem: {e}")
             raise HTTPException(status_code=500, detail="Failed to send message")
+
+    def broadcast(self, sender, message, recipients, chunk_size=None, concurrency=None, retries=None):
+        """Send `message` to `recipients` in provider-sized chunks.
+
+        Chunks are sent in parallel (at most `concurrency` at a time) and each
+        failed chunk is retried with exponential backoff. Returns one summary
+        dict per chunk instead of raising, so a partial failure doesn't hide
+        the chunks that went out.
+        """
+        chunk_size = chunk_size or int(os.environ.get("BROADCAST_CHUNK_SIZE", 500))
+        concurrency = concurrency or int(os.environ.get("BROADCAST_CONCURRENCY", 4))
+        retries = int(os.environ.get("BROADCAST_RETRIES", 3)) if retries is None else retries
+        chunks = [
+            recipients[i : i + chunk_size] for i in range(0, len(recipients), chunk_size)
+        ]
+
+        def send_chunk(index):
+            chunk = chunks[index]
+            attempt = 0
+            while True:
+                attempt += 1
+                try:
+                    self.sms.send(message, chunk, sender)
+                    return {"chunk": index, "recipients": len(chunk), "status": "sent", "attempts": attempt}
+                except Exception as e:
+                    if attempt > retries:
+                        logging.error(f"Broadcast chunk {index} failed: {e}")
+                        return {
+                            "chunk": index,
+                            "recipients": len(chunk),
+                            "status": "failed",
+                            "attempts": attempt,
+                            "error": str(e),
+                        }
+                    time.sleep(min(2 ** (attempt - 1), 30))
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(send_chunk, range(len(chunks))))
+        print(f"broadcast sent to {len(recipients)} recipients in {len(chunks)} chunks")
+        return results
@@ -0,0 +1,200 @@
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+from langchain.embeddings import CohereEmbeddings
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_question(question):
+    question = unicodedata.normalize("NFKC", question).casefold()
+    question = _PUNCTUATION.sub(" ", question)
+    return _WHITESPACE.sub(" ", question).strip()
+
+
+def _unit_vector(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(vector)) or 1.0
+    return vector / norm
+
+
+class AnswerCache:
+    """Answers to previously asked questions, per shortcode and language.
+
+    Questions are matched exactly after normalization (case, punctuation and
+    whitespace). When `similarity_threshold` is set and an `embed` function is
+    given, a question with no exact match is also compared against the cached
+    questions of the same shortcode by cosine similarity. Entries expire after
+    `ttl` seconds and the least recently used ones are evicted beyond
+    `maxsize`. Each entry remembers the Weaviate classes its answer came from so
+    uploads to a class can invalidate it.
+
+    The question vectors of each (shortcode, lang) are kept stacked in one
+    float32 matrix, rebuilt after that group changes, so a similarity lookup
+    is a single matrix-vector product computed outside the lock.
+    """
+
+    def __init__(self, maxsize=2048, ttl=86400, similarity_threshold=None, embed=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.embed = embed
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        # (shortcode, lang, normalized question) -> (answer, classes, vector, expires_at)
+        self._entries = OrderedDict()
+        # (shortcode, lang) -> (keys, matrix) snapshot, dropped when the group changes
+        self._matrices = {}
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    @property
+    def similarity_enabled(self):
+        return bool(self.similarity_threshold) and self.embed is not None
+
+    def lookup(self, shortcode, question, lang="hau"):
+        """Return (answer, vector); answer is None on a miss.
+
+        The question's embedding (if one was computed) is returned so that
+        store() doesn't have to embed the same question again.
+        """
+        key = (str(shortcode), lang, normalize_question(question))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[3] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0], entry[2]
+                del self._entries[key]
+                self._changed(key)
+
+        if not self.similarity_enabled or not key[2]:
+            with self._lock:
+                self.misses += 1
+            return None, None
+
+        try:
+            vector = _unit_vector(self.embed(key[2]))
+        except Exception as e:
+            logging.error(f"Failed to embed question for answer cache: {e}")
+            with self._lock:
+                self.misses += 1
+            return None, None
+
+        keys, matrix = self._matrix(key[:2])
+        if keys:
+            scores = matrix @ vector
+            candidates = np.flatnonzero(scores >= self.similarity_threshold)
+            candidates = candidates[np.argsort(-scores[candidates])]
+        else:
+            candidates = []
+        with self._lock:
+            # The snapshot may be stale: take the best match that is still live
+            for i in candidates:
+                entry = self._entries.get(keys[i])
+                if entry is not None and entry[3] > now:
+                    self._entries.move_to_end(keys[i])
+                    self.similar_hits += 1
+                    return entry[0], vector
+            self.misses += 1
+            return None, vector
+
+    def _matrix(self, group):
+        with self._lock:
+            snapshot = self._matrices.get(group)
+            if snapshot is not None:
+                return snapshot
+            version = self._versions.get(group, 0)
+            vectors = [
+                (key, entry[2])
+                for key, entry in self._entries.items()
+                if key[:2] == group and entry[2] is not None
+            ]
+        # Stack outside the lock; it is only kept if the group didn't change
+        keys = [key for key, _ in vectors]
+        matrix = np.stack([vector for _, vector in vectors]) if vectors else None
+        with self._lock:
+            if self._versions.get(group, 0) == version:
+                self._matrices[group] = (keys, matrix)
+        return keys, matrix
+
+    def _changed(self, key):
+        # Called with the lock held
+        group = key[:2]
+        self._versions[group] = self._versions.get(group, 0) + 1
+        self._matrices.pop(group, None)
+
+    def store(self, shortcode, question, answer, classes, lang="hau", vector=None):
+        key = (str(shortcode), lang, normalize_question(question))
+        if not key[2]:
+            return
+        if vector is None and self.similarity_enabled:
+            try:
+                vector = _unit_vector(self.embed(key[2]))
+            except Exception as e:
+                logging.error(f"Failed to embed question for answer cache: {e}")
+        with self._lock:
+            self._entries[key] = (
+                answer,
+                frozenset(c.upper() for c in classes),
+                vector,
+                time.monotonic() + self.ttl,
+            )
+            self._entries.move_to_end(key)
+            self._changed(key)
+            while len(self._entries) > self.maxsize:
+                self._changed(self._entries.popitem(last=False)[0])
+
+    def invalidate_class(self, class_name):
+        class_name = class_name.upper()
+        with self._lock:
+            for key in [k for k, v in self._entries.items() if class_name in v[1]]:
+                del self._entries[key]
+                self._changed(key)
+
+    def invalidate_shortcode(self, shortcode):
+        shortcode = str(shortcode)
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == shortcode]:
+                del self._entries[key]
+                self._changed(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "similarity_threshold": self.similarity_threshold,
+            }
+
+
+def _cohere_embed(text):
+    global _embeddings
+    if _embeddings is None:
+        _embeddings = CohereEmbeddings(
+            model=os.environ.get("COHERE_EMBED_MODEL", "embed-multilingual-v2.0")
+        )
+    return _embeddings.embed_query(text)
+
+
+_embeddings = None
+_threshold = os.environ.get("ANSWER_CACHE_SIMILARITY")
+
+answer_cache = AnswerCache(
+    maxsize=int(os.environ.get("ANSWER_CACHE_SIZE", 2048)),
+    ttl=float(os.environ.get("ANSWER_CACHE_TTL", 86400)),
+    similarity_threshold=float(_threshold) if _threshold else None,
+    embed=_cohere_embed if _threshold else None,
+)
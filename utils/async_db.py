@@ -0,0 +1,181 @@
+"""asyncpg versions of the db helpers used by the async routes.
+
+Same tables, return values and HTTPException behaviour as utils.db, but
+queries run on the event loop against their own connection pool, so a slow
+query no longer blocks every other request in the worker. utils.db stays the
+synchronous API for scripts, background threads and sync routes.
+"""
+import asyncio
+import json
+import os
+import re
+
+import asyncpg
+from fastapi import HTTPException
+
+from utils.db import FILES_QUERY, PAGE_SIZE, SHORT_CODES_QUERY, short_code_cache
+
+_pool = None
+_pool_lock = asyncio.Lock()
+
+
+async def get_pool():
+    global _pool
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                _pool = await asyncpg.create_pool(
+                    user=os.environ.get("DB_USERNAME"),
+                    password=os.environ.get("DB_PASSWORD"),
+                    host=os.environ.get("DB_HOST"),
+                    port=int(os.environ.get("DB_PORT") or 5432),
+                    database="postgres",
+                    min_size=int(os.environ.get("ASYNC_DB_POOL_MIN_SIZE", 1)),
+                    max_size=int(os.environ.get("ASYNC_DB_POOL_MAX_SIZE", 20)),
+                    max_inactive_connection_lifetime=float(
+                        os.environ.get("DB_POOL_MAX_LIFETIME", 1800)
+                    ),
+                )
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    async with _pool_lock:
+        if _pool is not None:
+            await _pool.close()
+            _pool = None
+
+
+def _acquire(pool):
+    return pool.acquire(timeout=float(os.environ.get("DB_POOL_TIMEOUT", 10)))
+
+
+# LISTINGS
+_PLACEHOLDER = re.compile(r"%[s%]")
+
+
+def _numbered(query):
+    """psycopg2's %s placeholders as asyncpg's $1, $2, ... (%% stays %)."""
+    count = 0
+
+    def replace(match):
+        nonlocal count
+        if match.group() == "%%":
+            return "%"
+        count += 1
+        return f"${count}"
+
+    return _PLACEHOLDER.sub(replace, query)
+
+
+async def list_page(query, params, key, after=None, limit=None, descending=False, stream=False):
+    """Async counterpart of utils.db.list_page, taking the same queries
+    (%s placeholders, {keyset} and {order})."""
+    keyset = ""
+    if after is not None:
+        keyset = f"AND {key} {'<' if descending else '>'} %s"
+        params = (*params, after)
+    query = _numbered(
+        query.format(keyset=keyset, order=f"{key} {'DESC' if descending else 'ASC'}")
+    )
+    if stream:
+        return _stream_rows(query, params)
+
+    limit = limit or PAGE_SIZE
+    try:
+        pool = await get_pool()
+        async with _acquire(pool) as conn:
+            # One extra row tells whether there is a next page
+            records = await conn.fetch(f"{query} LIMIT ${len(params) + 1}", *params, limit + 1)
+    except (asyncpg.PostgresError, OSError, asyncio.TimeoutError) as e:
+        raise HTTPException(status_code=500, detail=(str(e)))
+    rows = [dict(record) for record in records]
+    next_cursor = rows[limit - 1]["id"] if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+async def _stream_rows(query, params, batch_size=1000):
+    pool = await get_pool()
+    async with _acquire(pool) as conn:
+        # Server side cursors only live inside a transaction
+        async with conn.transaction():
+            async for record in conn.cursor(query, *params, prefetch=batch_size):
+                yield dict(record)
+
+
+async def ndjson_lines(rows):
+    async for row in rows:
+        yield json.dumps(row, default=str) + "\n"
+
+
+async def get_short_codes(organization, after=None, limit=None, stream=False):
+    return await list_page(
+        SHORT_CODES_QUERY, (organization,), "sc.id", after, limit, stream=stream
+    )
+
+
+async def get_files(organization_id, after=None, limit=None, stream=False):
+    return await list_page(
+        FILES_QUERY, (organization_id,), "scf.id", after, limit, stream=stream
+    )
+
+
+# FILES AND SHORT CODES
+async def add_file(file):
+    try:
+        pool = await get_pool()
+        async with _acquire(pool) as conn:
+            status = await conn.execute(
+                """
+                INSERT INTO files (name, organization_id, weaviate_class)
+                SELECT $1, id, $3 FROM organizations WHERE lower(name) = lower($2)
+                """,
+                file["name"],
+                file["organization"],
+                file["weaviate_class"],
+            )
+        # "INSERT 0 0" when the organization doesn't exist
+        return status.endswith(" 1")
+    except asyncpg.PostgresError as e:
+        print(e)
+        return False
+
+
+async def add_short_code(shortcode, organization_id):
+    try:
+        pool = await get_pool()
+        async with _acquire(pool) as conn:
+            await conn.execute(
+                "INSERT INTO short_codes (short_code, organization_id) VALUES ($1, $2)",
+                str(shortcode),
+                int(organization_id),
+            )
+        return True
+    except (asyncpg.PostgresError, ValueError) as e:
+        print(e)
+        return False
+
+
+async def add_file_to_short_code(short_code, file_name):
+    try:
+        pool = await get_pool()
+        async with _acquire(pool) as conn:
+            record = await conn.fetchrow(
+                """
+                INSERT INTO short_code_files (short_code_id, file_id)
+                SELECT sc.id, f.id FROM short_codes sc, files f
+                WHERE sc.short_code = $1 AND f.name = $2
+                LIMIT 1
+                RETURNING *
+                """,
+                str(short_code),
+                file_name,
+            )
+    except asyncpg.PostgresError as e:
+        print(e)
+        return None
+    if record is None:
+        return None
+    short_code_cache.invalidate(str(short_code))
+    return dict(record)
@@ -0,0 +1,79 @@
+import hashlib
+import re
+
+from langchain.schema import Document
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def content_hash(text):
+    """sha256 of the text with whitespace collapsed, so reflowed text matches."""
+    return hashlib.sha256(_WHITESPACE.sub(" ", text).strip().encode("utf-8")).hexdigest()
+
+
+def _split_long(sentence, size):
+    # Fallback for "sentences" longer than a chunk: split on words, then hard
+    words, part = sentence.split(" "), ""
+    for word in words:
+        while len(word) > size:
+            if part:
+                yield part
+                part = ""
+            yield word[:size]
+            word = word[size:]
+        if part and len(part) + 1 + len(word) > size:
+            yield part
+            part = word
+        else:
+            part = f"{part} {word}" if part else word
+    if part:
+        yield part
+
+
+def split_sentences(text, size):
+    text = _WHITESPACE.sub(" ", text).strip()
+    for sentence in _SENTENCE_END.split(text):
+        if len(sentence) > size:
+            yield from _split_long(sentence, size)
+        elif sentence:
+            yield sentence
+
+
+def chunk_text(text, size=1000, overlap=150):
+    """Split text into chunks of at most `size` characters on sentence
+    boundaries, repeating up to `overlap` characters of trailing sentences at
+    the start of the next chunk."""
+    chunks, current, length = [], [], 0
+    for sentence in split_sentences(text, size):
+        if current and length + 1 + len(sentence) > size:
+            chunks.append(" ".join(current))
+            # carry over whole sentences from the end of the previous chunk
+            carried, carried_length = [], 0
+            for previous in reversed(current):
+                if carried_length + len(previous) + 1 > overlap:
+                    break
+                carried.insert(0, previous)
+                carried_length += len(previous) + 1
+            current, length = carried, max(carried_length - 1, 0)
+            if current and length + 1 + len(sentence) > size:
+                current, length = [], 0
+        length += len(sentence) + (1 if current else 0)
+        current.append(sentence)
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def iter_chunks(pages, size=1000, overlap=150):
+    """Turn a stream of page Documents into a stream of chunk Documents."""
+    for page in pages:
+        for i, chunk in enumerate(chunk_text(page.page_content, size, overlap)):
+            yield Document(
+                page_content=chunk,
+                metadata={
+                    **page.metadata,
+                    "chunk": i,
+                    "content_hash": content_hash(chunk),
+                },
+            )
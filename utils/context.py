@@ -0,0 +1,72 @@
+import math
+import os
+import re
+
+from langchain.schema import Document
+
+from utils.chunking import split_sentences
+
+_TERM = re.compile(r"\w{3,}")
+
+# Cohere's multilingual tokenizer averages about 3 characters per token on
+# our Hausa and English documents; estimating on the low side keeps prompts
+# under the budget without calling the tokenizer for every passage.
+CHARS_PER_TOKEN = float(os.environ.get("CONTEXT_CHARS_PER_TOKEN", 3))
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _terms(text):
+    return set(term.lower() for term in _TERM.findall(text))
+
+
+def build_context(question, documents, budget, passage_size=400):
+    """Trim retrieved `documents` to the passages most relevant to `question`.
+
+    Documents are split into sentences, each scored by the idf weighted
+    overlap of its words with the question. Passages are taken best first
+    until `budget` tokens are used; ties (including questions that share no
+    words with the documents, e.g. Hausa questions on English files) keep the
+    retrieval order. The chosen passages are returned in document order.
+    """
+    passages = []
+    for rank, document in enumerate(documents):
+        for position, text in enumerate(split_sentences(document.page_content, passage_size)):
+            passages.append((rank, position, text, _terms(text)))
+    if not passages:
+        return []
+
+    frequency = {}
+    for *_, terms in passages:
+        for term in terms:
+            frequency[term] = frequency.get(term, 0) + 1
+    query = _terms(question)
+
+    def score(passage):
+        return sum(
+            math.log(1 + len(passages) / frequency[term])
+            for term in passage[3] & query
+        )
+
+    ranked = sorted(passages, key=lambda passage: (-score(passage), passage[0], passage[1]))
+    chosen, used = [], 0
+    for passage in ranked:
+        tokens = estimate_tokens(passage[2]) + 1
+        if used + tokens > budget:
+            continue
+        chosen.append(passage)
+        used += tokens
+    if not chosen:
+        # The best passage alone is over budget: cut it down to size
+        rank, position, text, terms = ranked[0]
+        chosen = [(rank, position, text[: int(budget * CHARS_PER_TOKEN)], terms)]
+
+    selected = {}
+    for rank, position, text, _ in sorted(chosen, key=lambda passage: passage[:2]):
+        selected.setdefault(rank, []).append(text)
+    return [
+        Document(page_content=" ".join(texts), metadata=documents[rank].metadata)
+        for rank, texts in selected.items()
+    ]
@@ -5,26 +5,137 @@ from fastapi import HTTPException
 from psycopg2 import Error
 from werkzeug.security import generate_password_hash
 import os
+import threading
+import uuid
 import psycopg2.extras
+from utils.phone import normalize_number, split_numbers
+from utils.cache import TTLCache
+from utils.pool import ConnectionPool
+from utils.senders import registered_senders
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# shortcode -> short_code_files/short_codes/files row, see get_short_code
+short_code_cache = TTLCache(
+    ttl=float(os.environ.get("SHORT_CODE_CACHE_TTL", 300)),
+    maxsize=int(os.environ.get("SHORT_CODE_CACHE_SIZE", 1024)),
+)
+
+
+def _connect():
+    user = os.environ.get("DB_USERNAME")
+    password = os.environ.get("DB_PASSWORD")
+    host = os.environ.get("DB_HOST")
+    port = os.environ.get("DB_PORT")
+    return psycopg2.connect(
+        user=user, password=password, host=host, port=port, database="postgres",
+        cursor_factory=psycopg2.extras.RealDictCursor,  # Return rows as dictionaries
+    )
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    _connect,
+                    min_size=int(os.environ.get("DB_POOL_MIN_SIZE", 1)),
+                    max_size=int(os.environ.get("DB_POOL_MAX_SIZE", 10)),
+                    max_lifetime=float(os.environ.get("DB_POOL_MAX_LIFETIME", 1800)),
+                    health_check_interval=float(
+                        os.environ.get("DB_POOL_HEALTH_CHECK_INTERVAL", 30)
+                    ),
+                    timeout=float(os.environ.get("DB_POOL_TIMEOUT", 10)),
+                )
+    return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
 
 
 def create_connection():
-    conn = None
+    # Borrow a connection from the pool; conn.close() returns it to the pool.
     try:
-        user = os.environ.get("DB_USERNAME")
-        password = os.environ.get("DB_PASSWORD")
-        host = os.environ.get("DB_HOST")
-        port = os.environ.get("DB_PORT")
-        conn = psycopg2.connect(
-            user=user, password=password, host=host, port=port, database="postgres",
-            cursor_factory=psycopg2.extras.RealDictCursor,  # Return rows as dictionaries
+        return get_pool().getconn()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=(str(e)))
 
-        )
-        return conn
+
+# LISTINGS
+PAGE_SIZE = int(os.environ.get("PAGE_SIZE", 100))
+
+# Shared with utils.async_db, which converts the %s placeholders
+SHORT_CODES_QUERY = """
+    SELECT sc.id, sc.short_code, sc.organization_id, sc.retrieval_k,
+        sc.context_tokens, sc.language, o.name
+    FROM short_codes sc
+    JOIN organizations o ON sc.organization_id = o.id
+    WHERE lower(o.name) = lower(%s) {keyset}
+    ORDER BY {order}
+"""
+
+FILES_QUERY = """
+    SELECT scf.id, sc.short_code, f.name
+    FROM short_codes sc
+    JOIN short_code_files scf ON sc.id = scf.short_code_id
+    JOIN files f ON f.id = scf.file_id
+    WHERE sc.organization_id = %s {keyset}
+    ORDER BY {order}
+"""
+
+
+def list_page(query, params, key, after=None, limit=None, descending=False, stream=False):
+    """Run a listing query one keyset page at a time.
+
+    `query` has a {keyset} placeholder inside its WHERE clause and an
+    {order} placeholder for its ORDER BY; `key` is the unique column pages
+    are ordered by. Returns (rows, next_cursor), next_cursor being None on
+    the last page. With `stream` every row after `after` is yielded from a
+    server side cursor instead, so exports never hold the whole result.
+    """
+    keyset = ""
+    if after is not None:
+        keyset = f"AND {key} {'<' if descending else '>'} %s"
+        params = (*params, after)
+    query = query.format(keyset=keyset, order=f"{key} {'DESC' if descending else 'ASC'}")
+    if stream:
+        return _stream_rows(query, params)
+
+    limit = limit or PAGE_SIZE
+    conn = create_connection()
+    cursor = conn.cursor()
+    try:
+        # One extra row tells whether there is a next page
+        cursor.execute(query + " LIMIT %s", (*params, limit + 1))
+        rows = cursor.fetchall()
+        conn.commit()
     except Exception as e:
         raise HTTPException(status_code=500, detail=(str(e)))
+    finally:
+        conn.close()
+    next_cursor = rows[limit - 1]["id"] if len(rows) > limit else None
+    return rows[:limit], next_cursor
 
 
+def _stream_rows(query, params, batch_size=1000):
+    conn = create_connection()
+    try:
+        cursor = conn.cursor(name=f"stream_{uuid.uuid4().hex}")
+        cursor.itersize = batch_size
+        cursor.execute(query, params)
+        yield from cursor
+        cursor.close()
+    finally:
+        conn.close()
+
 
 # SETUP DB
 def clear_db():
@@ -39,74 +150,28 @@ def clear_db():
         DROP TABLE IF EXISTS short_codes CASCADE;
         DROP TABLE IF EXISTS short_code_files CASCADE;
         DROP TABLE IF EXISTS messages CASCADE;
+        DROP TABLE IF EXISTS phone_numbers CASCADE;
+        DROP TABLE IF EXISTS outbound_sms_events CASCADE;
+        DROP TABLE IF EXISTS outbound_sms CASCADE;
+        DROP TABLE IF EXISTS conversations CASCADE;
+        DROP TABLE IF EXISTS schema_migrations CASCADE;
         DROP TABLE IF EXISTS areas CASCADE;"""
         )
         conn.commit()
         print(f"DB cleared successfully")
     except Exception as e:
         raise HTTPException(status_code=500, detail=(str(e)))
-
-    conn.commit()
-    conn.close()
+    finally:
+        conn.close()
 
 
 def init_db():
-    conn = create_connection()
-    cursor = conn.cursor()
-    # Clear and create the organizations table
+    # Clear the database and build it from the versioned migrations
     clear_db()
-    try:
-        cursor.execute(
-            """CREATE TABLE organizations
-            (id SERIAL PRIMARY KEY,
-            name TEXT NOT NULL UNIQUE,
-            email TEXT NOT NULL UNIQUE,
-            password TEXT NOT NULL,
-            address TEXT NOT NULL,
-            description TEXT NOT NULL);
-            
-            CREATE TABLE files
-            (id SERIAL PRIMARY KEY,
-            name TEXT NOT NULL,
-            organization_id INTEGER NOT NULL,
-            weaviate_class TEXT NOT NULL UNIQUE,
-            UNIQUE (name, organization_id),
-            FOREIGN KEY (organization_id) REFERENCES organizations(id));
-            
-            CREATE TABLE short_codes
-            (id SERIAL PRIMARY KEY,
-            short_code TEXT NOT NULL UNIQUE,
-            organization_id INTEGER NOT NULL,
-            UNIQUE (short_code, organization_id),
-            FOREIGN KEY (organization_id) REFERENCES organizations(id));
-            
-            CREATE TABLE short_code_files
-            (id SERIAL PRIMARY KEY,
-            short_code_id INTEGER NOT NULL,
-            file_id SERIAL NOT NULL,
-            UNIQUE (short_code_id, file_id),
-            FOREIGN KEY (file_id) REFERENCES files(id),
-            FOREIGN KEY (short_code_id) REFERENCES short_codes(id));
-            
-            CREATE TABLE messages
-            (id SERIAL PRIMARY KEY,
-            content TEXT NOT NULL,
-            shortcode_id INT NOT NULL,
-            organization_id INTEGER NOT NULL,
-            areas TEXT NOT NULL,
-            FOREIGN KEY (organization_id) REFERENCES organizations(id));
-            
-            CREATE TABLE areas
-            (id SERIAL PRIMARY KEY,
-            name TEXT NOT NULL,
-            numbers TEXT NOT NULL);"""
-        )
-        conn.commit()
-        print(f"DB initialized successfully")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=(str(e)))
+    from utils.migrations import run_migrations
 
-    conn.close()
+    run_migrations()
+    print(f"DB initialized successfully")
 
 
 def insert_dummy_data():
@@ -115,16 +180,19 @@ def insert_dummy_data():
     try:
         cursor.execute(
             """
-            INSERT INTO areas (name, numbers) VALUES 
-            ('zaria - Kaduna state','+2348162577778');
+            WITH area AS (
+                INSERT INTO areas (name) VALUES ('zaria - Kaduna state') RETURNING id
+            )
+            INSERT INTO phone_numbers (area_id, e164_number)
+            SELECT id, '+2348162577778' FROM area;
             """
         )
         conn.commit()
         print(f"DB Populated successfully")
     except Exception as e:
         raise HTTPException(status_code=500, detail=(str(e)))
-
-    conn.close()
+    finally:
+        conn.close()
 
 
 # ORGANIZATIONS
@@ -145,18 +213,17 @@ def add_organization(organization):
             ),
         )
         conn.commit()
+
+        last_row_id = cursor.lastrowid
+        if last_row_id:
+            cursor.execute("SELECT * FROM organizations WHERE id = %s", (last_row_id,))
+            return cursor.fetchone()
+        else:
+            return {"error": error}
     except Exception as e:
         raise HTTPException(status_code=500, detail=(str(e)))
-
-    last_row_id = cursor.lastrowid
-    if last_row_id:
-        cursor.execute("SELECT * FROM organizations WHERE id = %s", (last_row_id,))
-        row = cursor.fetchone()
-        conn.close()
-        return row
-    else:
+    finally:
         conn.close()
-        return {"error": error}
 
 
 def get_organization(email: str):
@@ -165,10 +232,11 @@ def get_organization(email: str):
 
     try:
         cursor.execute("SELECT * FROM organizations WHERE email = %s", (email,))
+        result = cursor.fetchone()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    result = cursor.fetchone()
-    conn.close()
+    finally:
+        conn.close()
     
     if result:
         if isinstance(result, tuple):
@@ -200,52 +268,84 @@ def add_short_code(shortcode, organization_id):
         )
 
         conn.commit()
-        conn.close()
         return True
     except Error as e:
         print(e)
         conn.rollback()
         return False
+    finally:
+        conn.close()
+
 
 
+def get_short_codes(organization, after=None, limit=None, stream=False):
+    return list_page(
+        SHORT_CODES_QUERY, (organization,), "sc.id", after, limit, stream=stream
+    )
 
-def get_short_codes(organization):
+
+def get_short_code(shortcode):
+    # Returns one row per file attached to the shortcode.
+    # The mapping only changes when files are attached or shortcodes deleted,
+    # both of which invalidate the cached entry.
+    return short_code_cache.get_or_load(
+        str(shortcode), lambda: _fetch_short_code(shortcode)
+    )
+
+
+def _fetch_short_code(shortcode):
     conn = create_connection()
     cursor = conn.cursor()
 
     try:
         cursor.execute(
-            "SELECT * FROM short_codes JOIN organizations ON short_codes.organization_id = organizations.id WHERE organizations.name ilike %s",
-            (organization,),
+            """
+            SELECT *
+            FROM short_code_files as scf
+            JOIN short_codes as sc ON scf.short_code_id = sc.id
+            JOIN files as f ON scf.file_id = f.id
+            WHERE sc.short_code = %s
+            ORDER BY scf.id;
+            """,
+            (shortcode,),
         )
+        result = cursor.fetchall()
         conn.commit()
     except Exception as e:
         raise HTTPException(status_code=500, detail=(str(e)))
-    results = cursor.fetchall()
-    conn.close()
-    return results
+    finally:
+        conn.close()
+    return result
 
 
-def get_short_code(shortcode):
+def update_short_code_settings(
+    short_code, retrieval_k=None, context_tokens=None, language=None
+):
+    """Set how many chunks are retrieved for a shortcode, how many tokens of
+    them go into the prompt and the language assumed when a question's
+    language can't be detected; None falls back to the server defaults."""
     conn = create_connection()
     cursor = conn.cursor()
-
     try:
         cursor.execute(
             """
-            SELECT *
-            FROM short_code_files as scf
-            JOIN short_codes as sc ON scf.short_code_id = sc.id
-            JOIN files as f ON scf.file_id = f.id
-            WHERE sc.short_code = %s;
+            UPDATE short_codes
+            SET retrieval_k = %s, context_tokens = %s, language = %s
+            WHERE short_code = %s
+            RETURNING id, short_code, retrieval_k, context_tokens, language
             """,
-            (shortcode,),
+            (retrieval_k, context_tokens, language, str(short_code)),
         )
         result = cursor.fetchone()
         conn.commit()
     except Exception as e:
+        conn.rollback()
         raise HTTPException(status_code=500, detail=(str(e)))
-    conn.close()
+    finally:
+        conn.close()
+    if result is None:
+        raise HTTPException(status_code=404, detail="Shortcode not found")
+    short_code_cache.invalidate(str(short_code))
     return result
 
 
@@ -254,13 +354,15 @@ def delete_short_code(id):
     cursor = conn.cursor()
 
     try:
-        cursor.execute("DELETE FROM short_codes WHERE id = %s RETURNING *", (id))
+        cursor.execute("DELETE FROM short_codes WHERE id = %s RETURNING *", (id,))
         row = cursor.fetchone()
+        conn.commit()
+        if row:
+            short_code_cache.invalidate(str(row["short_code"]))
     except Exception as e:
         raise HTTPException(status_code=500, detail=(str(e)))
-
-    conn.commit()
-    conn.close()
+    finally:
+        conn.close()
     return row
 
 
@@ -271,7 +373,8 @@ def add_file(file):
     cursor = conn.cursor()
     try:
         cursor.execute(
-            "SELECT id FROM organizations WHERE name ilike %s", (file["organization"],)
+            "SELECT id FROM organizations WHERE lower(name) = lower(%s)",
+            (file["organization"],),
         )
         found_organization = cursor.fetchone()
         cursor.execute(
@@ -284,21 +387,44 @@ def add_file(file):
         )
         last_row_id = cursor.lastrowid
         cursor.execute("SELECT * FROM files WHERE id = %s", (last_row_id,))
+        conn.commit()
         status = True
     except Error as e:
         print(e)
         status = False
-    
-
-    conn.commit()
-    conn.close()
+    finally:
+        conn.close()
     return status
 
 
 
+def get_file_sources():
+    """Every file's Weaviate class with its organization and a shortcode."""
+    conn = create_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            SELECT f.weaviate_class, f.name AS file, f.organization_id,
+                o.name AS organization, min(sc.short_code) AS shortcode
+            FROM files f
+            JOIN organizations o ON o.id = f.organization_id
+            LEFT JOIN short_code_files scf ON scf.file_id = f.id
+            LEFT JOIN short_codes sc ON sc.id = scf.short_code_id
+            GROUP BY f.id, o.name
+            """
+        )
+        return cursor.fetchall()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=(str(e)))
+    finally:
+        conn.close()
+
+
 def add_file_to_short_code(short_code, file_id):
     conn = create_connection()
     cursor = conn.cursor()
+    row = None
 
     try:
         cursor.execute(
@@ -319,6 +445,7 @@ def add_file_to_short_code(short_code, file_id):
                 (found_short_code['id'], found_file['id']),  # Use found_short_code["id"] as short_code_id and found_file["id"] as file_id
             )
             conn.commit()
+            short_code_cache.invalidate(str(short_code))
             last_row_id = cursor.lastrowid
             cursor.execute(
                 "SELECT * FROM short_code_files WHERE id = %s", (last_row_id,)
@@ -327,13 +454,14 @@ def add_file_to_short_code(short_code, file_id):
     except Error as e:
         print(e)
         row = None  # Set row to None if an error occurs
-    conn.close()
+    finally:
+        conn.close()
     return row
 
 
 
 
-def add_message(message, organization, shortcode, areas):
+def add_message(message, organization, shortcode, areas, segments=None, encoding=None):
     conn = create_connection()
     cursor = conn.cursor()
     try:
@@ -343,67 +471,85 @@ def add_message(message, organization, shortcode, areas):
         )
         found_shortcode = cursor.fetchone()
         cursor.execute(
-            "INSERT INTO messages (content, organization_id, shortcode_id, areas) VALUES (%s, %s, %s, %s)",
+            "INSERT INTO messages (content, organization_id, shortcode_id, areas, segments, encoding) VALUES (%s, %s, %s, %s, %s, %s)",
             (
                 message,
                 found_shortcode["organization_id"],
                 found_shortcode["id"],
                 "|".join(areas),
+                segments,
+                encoding,
             ),
         )
         conn.commit()
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=(str(e)))
-    conn.close()
-
-
-def get_messages(organization):
-    conn = create_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            "SELECT * FROM messages JOIN organizations ON messages.organization_id = organizations.id JOIN short_codes ON shortcode_id = short_codes.id WHERE organizations.name = %s",
-            (organization,),
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=(str(e)))
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
+    finally:
+        conn.close()
 
 
-def get_areas():
-    conn = create_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("SELECT * FROM areas")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=(str(e)))
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
-
-
-def get_files(organization_id):
-    conn = create_connection()
-    cursor = conn.cursor()
-    try:
-
-        cursor.execute(
-            """
-            SELECT sc.short_code, f.name
-            FROM short_codes sc
-            JOIN short_code_files scf ON sc.id = scf.short_code_id
-            JOIN files f ON f.id = scf.file_id
-            WHERE sc.organization_id = %s
-            """,
-        (organization_id,))
-        joined_data = cursor.fetchall()
-    except Error as e:
-        print(e)
-    conn.close()
-    return joined_data
+def get_messages(organization, after=None, limit=None, stream=False):
+    # Newest first; the organization's own columns (password hash included)
+    # aren't needed by the dashboard
+    return list_page(
+        """
+        SELECT m.id, m.content, m.areas, m.segments, m.encoding,
+            m.organization_id, m.shortcode_id, sc.short_code, o.name
+        FROM messages m
+        JOIN organizations o ON m.organization_id = o.id
+        JOIN short_codes sc ON m.shortcode_id = sc.id
+        WHERE o.name = %s {keyset}
+        ORDER BY {order}
+        """,
+        (organization,),
+        "m.id",
+        after,
+        limit,
+        descending=True,
+        stream=stream,
+    )
+
+
+def get_areas(after=None, limit=None, stream=False):
+    # Only a count per area, so a page stays small however many numbers an
+    # area has; the numbers themselves are paged by get_area_numbers
+    return list_page(
+        """
+        SELECT a.id, a.name,
+            (SELECT count(*) FROM phone_numbers p WHERE p.area_id = a.id) AS number_count
+        FROM areas a
+        WHERE TRUE {keyset}
+        ORDER BY {order}
+        """,
+        (),
+        "a.id",
+        after,
+        limit,
+        stream=stream,
+    )
+
+
+def get_area_numbers(area_id, after=None, limit=None, stream=False):
+    return list_page(
+        """
+        SELECT p.id, p.e164_number
+        FROM phone_numbers p
+        WHERE p.area_id = %s {keyset}
+        ORDER BY {order}
+        """,
+        (area_id,),
+        "p.id",
+        after,
+        limit,
+        stream=stream,
+    )
+
+
+def get_files(organization_id, after=None, limit=None, stream=False):
+    return list_page(
+        FILES_QUERY, (organization_id,), "scf.id", after, limit, stream=stream
+    )
 
 
 
@@ -427,34 +573,36 @@ def get_files(organization_id):
 #         conn.close()
 
 
+def _insert_numbers(cursor, area_id, numbers):
+    psycopg2.extras.execute_values(
+        cursor,
+        """
+        INSERT INTO phone_numbers (area_id, e164_number) VALUES %s
+        ON CONFLICT (e164_number, area_id) DO NOTHING
+        """,
+        [(area_id, number) for number in numbers],
+    )
+
+
 def insert_new_numbers(area_name, new_number):
     conn = create_connection()
     cursor = conn.cursor()
     try:
-        # Fetch the current numbers from the database
-        cursor.execute("SELECT numbers FROM areas WHERE name = %s", (area_name,))
+        cursor.execute("SELECT id FROM areas WHERE name = %s", (area_name,))
         result = cursor.fetchone()
         if not result:
             raise HTTPException(status_code=404, detail="Area not found")
 
-        current_numbers = result["numbers"]  # Extracting the numbers from the result
-
-        # Check if the current numbers are empty or not
-        if current_numbers:
-            # If not empty, append the new number to the existing numbers
-            updated_numbers = f"{current_numbers}, {new_number}"
-        else:
-            # If empty, just use the new number
-            updated_numbers = new_number
-
-        # Update the numbers in the database
-        cursor.execute(
-            "UPDATE areas SET numbers = %s WHERE name = %s",
-            (updated_numbers, area_name)
-        )
+        numbers = split_numbers(new_number)
+        _insert_numbers(cursor, result["id"], numbers)
         conn.commit()
+        registered_senders.add(numbers)
         print(f"Number '{new_number}' added successfully to area '{area_name}'")
         return True
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     finally:
@@ -467,42 +615,76 @@ def get_phone_numbers():
     cursor = conn.cursor()
 
     try:
-        cursor.execute("SELECT numbers FROM areas")
+        cursor.execute("SELECT DISTINCT e164_number FROM phone_numbers")
         results = cursor.fetchall()
     except Exception as e:
-        conn.close()
         raise HTTPException(status_code=500, detail=f"Database query failed: {str(e)}")
-    
-    conn.close()
+    finally:
+        conn.close()
 
     if not results:
         raise HTTPException(status_code=500, detail="No phone numbers found")
 
-    # Extract and flatten the phone numbers from the results
-    phone_numbers = []
+    return [row["e164_number"] for row in results]
+
+
+def get_area_phone_numbers(areas):
+    """Registered numbers in any of the named areas, without duplicates."""
+    conn = create_connection()
+    cursor = conn.cursor()
     try:
-        for row in results:
-            numbers = row['numbers'].split(", ")
-            cleaned_numbers = [number.strip() for number in numbers]
-            phone_numbers.extend(cleaned_numbers)
+        cursor.execute(
+            """
+            SELECT DISTINCT p.e164_number
+            FROM phone_numbers p
+            JOIN areas a ON a.id = p.area_id
+            WHERE a.name = ANY(%s)
+            """,
+            (list(areas),),
+        )
+        return [row["e164_number"] for row in cursor.fetchall()]
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing phone numbers: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Database query failed: {str(e)}")
+    finally:
+        conn.close()
 
-    return phone_numbers
+
+def get_registered_numbers():
+    # Same as get_phone_numbers, but an empty registry is not an error
+    conn = create_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT DISTINCT e164_number FROM phone_numbers")
+        return [row["e164_number"] for row in cursor.fetchall()]
+    finally:
+        conn.close()
 
 
 def confirm_phone_number(phone_number):
+    try:
+        phone_number = normalize_number(phone_number)
+    except ValueError:
+        return
+
+    # Answer from the in-memory registry once it has been loaded at startup
+    if registered_senders.loaded:
+        if phone_number in registered_senders:
+            return {"e164_number": phone_number}
+        return
+
     conn = create_connection()
     cursor = conn.cursor()
 
     try:
-        cursor.execute("SELECT numbers FROM areas WHERE numbers=%s", (phone_number,))
-        result = cursor.fetchone()
-        conn.close()
-        return result
+        cursor.execute(
+            "SELECT e164_number FROM phone_numbers WHERE e164_number = %s LIMIT 1",
+            (phone_number,),
+        )
+        return cursor.fetchone()
     except Exception as e:
-        conn.close()
         return
+    finally:
+        conn.close()
 
 
 def delete_number(area_name, number):
@@ -510,26 +692,31 @@ def delete_number(area_name, number):
     cursor = conn.cursor()
     print("number: ",number)
     try:
-        cursor.execute("SELECT numbers FROM areas WHERE name = %s", (area_name,))
+        cursor.execute("SELECT id FROM areas WHERE name = %s", (area_name,))
         result = cursor.fetchone()
         if not result:
             raise HTTPException(status_code=404, detail="Area not found")
 
-        current_numbers = result['numbers']  # Accessing by column name
-        numbers_list = current_numbers.split(',')
-
-        if number not in numbers_list:
+        number = normalize_number(number)
+        cursor.execute(
+            "DELETE FROM phone_numbers WHERE e164_number = %s AND area_id = %s RETURNING id",
+            (number, result["id"]),
+        )
+        if not cursor.fetchone():
             raise HTTPException(status_code=404, detail=f"Number {number} not found in the area")
 
-        numbers_list.remove(number)
-        updated_numbers = ','.join(numbers_list)
-
+        # The number may still be registered through another area
         cursor.execute(
-            "UPDATE areas SET numbers = %s WHERE name = %s",
-            (updated_numbers, area_name)
+            "SELECT 1 FROM phone_numbers WHERE e164_number = %s LIMIT 1", (number,)
         )
+        still_registered = cursor.fetchone()
         conn.commit()
+        if not still_registered:
+            registered_senders.discard([number])
         logging.info(f"Number '{number}' deleted successfully from area '{area_name}'")
+    except HTTPException:
+        conn.rollback()
+        raise
     except Exception as e:
         conn.rollback()
         logging.error(f"Error deleting number: {str(e)}", exc_info=True)
@@ -545,17 +732,253 @@ def add_area(name: str, numbers: str) -> bool:
     conn = create_connection()
     cursor = conn.cursor()
     try:
+        numbers = split_numbers(numbers)
         cursor.execute(
             """
-            INSERT INTO areas (name, numbers) VALUES (%s, %s);
+            INSERT INTO areas (name) VALUES (%s) RETURNING id;
             """,
-            (name, numbers)
+            (name,)
         )
+        area_id = cursor.fetchone()["id"]
+        _insert_numbers(cursor, area_id, numbers)
         conn.commit()
-        conn.close()
+        registered_senders.add(numbers)
         return True
     except Exception as e:
         conn.rollback()
-        conn.close()
         print(e)
         return False
+    finally:
+        conn.close()
+
+
+# OUTBOUND SMS QUEUE
+def enqueue_sms(
+    sender, message, recipients, batch_size=500, segments=None, encoding=None, priority=0
+):
+    """Queue `message` for `recipients`, one job per `batch_size` recipients.
+
+    `segments` and `encoding` describe the message as billed (see
+    utils.sms_encoding) and are stored on every job. Jobs with a lower
+    `priority` are claimed first.
+    """
+    batches = [
+        recipients[i : i + batch_size] for i in range(0, len(recipients), batch_size)
+    ]
+    conn = create_connection()
+    cursor = conn.cursor()
+    try:
+        rows = psycopg2.extras.execute_values(
+            cursor,
+            "INSERT INTO outbound_sms (sender, message, recipients, segments, encoding, priority) VALUES %s RETURNING id",
+            [(sender, message, batch, segments, encoding, priority) for batch in batches],
+            fetch=True,
+        )
+        job_ids = [row["id"] for row in rows]
+        psycopg2.extras.execute_values(
+            cursor,
+            "INSERT INTO outbound_sms_events (job_id, status) VALUES %s",
+            [(job_id, "pending") for job_id in job_ids],
+        )
+        conn.commit()
+        return job_ids
+    except Exception as e:
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=(str(e)))
+    finally:
+        conn.close()
+
+
+def record_sms(sender, message, recipients, status, segments, encoding, detail=None):
+    """Log an SMS that was sent directly rather than through the queue."""
+    conn = create_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            INSERT INTO outbound_sms
+            (sender, message, recipients, status, attempts, last_error, segments, encoding)
+            VALUES (%s, %s, %s, %s, 1, %s, %s, %s)
+            RETURNING id
+            """,
+            (sender, message, recipients, status, detail, segments, encoding),
+        )
+        job_id = cursor.fetchone()["id"]
+        cursor.execute(
+            "INSERT INTO outbound_sms_events (job_id, status, detail) VALUES (%s, %s, %s)",
+            (job_id, status, detail),
+        )
+        conn.commit()
+        return job_id
+    except Exception as e:
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=(str(e)))
+    finally:
+        conn.close()
+
+
+def claim_sms_jobs(max_recipients, stale_after=600, limit=100):
+    """Mark due jobs holding up to `max_recipients` recipients in total as
+    sending and return them, lowest priority value first.
+
+    The first job is always claimed, even when it alone holds more. Jobs
+    left in 'sending' for more than `stale_after` seconds (a dispatcher died
+    mid-send) are picked up again, so callers must claim no more than they
+    can send in that time. SKIP LOCKED lets several dispatchers drain the
+    queue without handing out the same job twice.
+    """
+    conn = create_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            WITH due AS (
+                SELECT id, priority, next_attempt_at, cardinality(recipients) AS size
+                FROM outbound_sms
+                WHERE (status = 'pending' AND next_attempt_at <= now())
+                OR (status = 'sending' AND updated_at < now() - %s * interval '1 second')
+                ORDER BY priority, next_attempt_at, id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            ), running AS (
+                SELECT id, row_number() OVER w AS position, sum(size) OVER w AS total
+                FROM due
+                WINDOW w AS (ORDER BY priority, next_attempt_at, id)
+            )
+            UPDATE outbound_sms
+            SET status = 'sending', attempts = attempts + 1, updated_at = now()
+            WHERE id IN (
+                SELECT id FROM running WHERE position = 1 OR total <= %s
+            )
+            RETURNING *
+            """,
+            (stale_after, limit, max_recipients),
+        )
+        jobs = sorted(
+            cursor.fetchall(), key=lambda job: (job["priority"], job["next_attempt_at"], job["id"])
+        )
+        if jobs:
+            psycopg2.extras.execute_values(
+                cursor,
+                "INSERT INTO outbound_sms_events (job_id, status) VALUES %s",
+                [(job["id"], "sending") for job in jobs],
+            )
+        conn.commit()
+        return jobs
+    except Exception as e:
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=(str(e)))
+    finally:
+        conn.close()
+
+
+def update_sms_job(job_id, status, detail=None, recipients=None, retry_in=None):
+    """Record a status transition; with `retry_in` the job goes back to pending."""
+    conn = create_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            UPDATE outbound_sms
+            SET status = %s,
+                last_error = %s,
+                recipients = COALESCE(%s, recipients),
+                next_attempt_at = now() + COALESCE(%s, 0) * interval '1 second',
+                updated_at = now()
+            WHERE id = %s
+            """,
+            (status, detail, recipients, retry_in, job_id),
+        )
+        cursor.execute(
+            "INSERT INTO outbound_sms_events (job_id, status, detail) VALUES (%s, %s, %s)",
+            (job_id, status, detail),
+        )
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=(str(e)))
+    finally:
+        conn.close()
+
+
+def get_sms_queue_stats():
+    conn = create_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT status, count(*) AS count FROM outbound_sms GROUP BY status")
+        return {row["status"]: row["count"] for row in cursor.fetchall()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=(str(e)))
+    finally:
+        conn.close()
+
+
+# CONVERSATIONS
+def get_conversation(key, ttl):
+    """The packed turns of a conversation active in the last `ttl` seconds."""
+    conn = create_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            SELECT turns FROM conversations
+            WHERE key = %s AND updated_at > now() - %s * interval '1 second'
+            """,
+            (key, ttl),
+        )
+        row = cursor.fetchone()
+        conn.commit()
+        return bytes(row["turns"]) if row else None
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=(str(e)))
+    finally:
+        conn.close()
+
+
+def save_conversation(key, turns):
+    conn = create_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            INSERT INTO conversations (key, turns) VALUES (%s, %s)
+            ON CONFLICT (key) DO UPDATE SET turns = EXCLUDED.turns, updated_at = now()
+            """,
+            (key, psycopg2.Binary(turns)),
+        )
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=(str(e)))
+    finally:
+        conn.close()
+
+
+def delete_conversation(key):
+    conn = create_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM conversations WHERE key = %s", (key,))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=(str(e)))
+    finally:
+        conn.close()
+
+
+def purge_conversations(ttl):
+    conn = create_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "DELETE FROM conversations WHERE updated_at < now() - %s * interval '1 second'",
+            (ttl,),
+        )
+        conn.commit()
+        return cursor.rowcount
+    except Exception as e:
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=(str(e)))
+    finally:
+        conn.close()
@@ -0,0 +1,173 @@
+import fcntl
+import mmap
+import os
+import re
+import struct
+import threading
+
+from langchain.embeddings import CohereEmbeddings
+
+_HEADER = struct.Struct("<5sI")  # magic, vector dimension
+_MAGIC = b"CEMB1"
+_DIGEST_SIZE = 32  # sha256
+
+
+class EmbeddingStore:
+    """Append-only on-disk map of content hash -> float32 vector.
+
+    The file is a small header followed by fixed size records of
+    (32 byte sha256 digest, dim float32s), read through mmap, so a vector
+    costs 4 bytes per dimension on disk and nothing on the heap until it is
+    read. Only digest -> offset is kept in memory. Appends take an exclusive
+    flock so several processes can share one file; records written by other
+    processes are picked up on the next miss.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.dim = None
+        self.hits = 0
+        self.misses = 0
+        self._index = {}
+        self._scanned = 0
+        self._mm = None
+        self._lock = threading.Lock()
+        with self._lock:
+            self._refresh()
+
+    def get(self, digest):
+        key = bytes.fromhex(digest)
+        with self._lock:
+            offset = self._index.get(key)
+            if offset is None:
+                self._refresh()
+                offset = self._index.get(key)
+            if offset is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return list(struct.unpack_from(f"<{self.dim}f", self._mm, offset))
+
+    def put_many(self, items):
+        """Store (digest, vector) pairs."""
+        if not items:
+            return
+        dim = len(items[0][1])
+        record = struct.Struct(f"<{_DIGEST_SIZE}s{dim}f")
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "ab") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    if f.tell() == 0:
+                        f.write(_HEADER.pack(_MAGIC, dim))
+                    elif self.dim is not None and self.dim != dim:
+                        raise ValueError(f"Expected {self.dim} dimensional vectors, got {dim}")
+                    for digest, vector in items:
+                        f.write(record.pack(bytes.fromhex(digest), *vector))
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+            self._refresh()
+
+    def __len__(self):
+        return len(self._index)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "path": self.path,
+                "size": len(self._index),
+                "dim": self.dim,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _refresh(self):
+        # Index records appended since the last scan (by us or other processes)
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return
+        if size <= max(self._scanned, _HEADER.size - 1):
+            return
+        with open(self.path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.dim is None:
+            magic, self.dim = _HEADER.unpack_from(mm, 0)
+            if magic != _MAGIC:
+                raise ValueError(f"{self.path} is not an embedding cache file")
+            self._scanned = _HEADER.size
+        record_size = _DIGEST_SIZE + 4 * self.dim
+        # A record still being written by another process is left for later
+        end = self._scanned + (size - self._scanned) // record_size * record_size
+        for offset in range(self._scanned, end, record_size):
+            self._index[mm[offset : offset + _DIGEST_SIZE]] = offset + _DIGEST_SIZE
+        self._scanned = end
+        if self._mm is not None:
+            self._mm.close()
+        self._mm = mm
+
+
+class EmbeddingCache:
+    """Embeds texts with Cohere, reusing vectors already stored on disk."""
+
+    def __init__(self, directory, model):
+        self.model = model
+        safe_model = re.sub(r"[^\w.-]", "_", model)
+        self.store = EmbeddingStore(os.path.join(directory, f"{safe_model}.emb"))
+        self._embeddings = None
+
+    def embed_documents(self, texts):
+        if self._embeddings is None:
+            self._embeddings = CohereEmbeddings(model=self.model)
+        return self._embeddings.embed_documents(texts)
+
+    def with_vectors(self, objects, batch_size=96):
+        """Attach a vector to each Weaviate import object (see BatchImporter).
+
+        Objects are looked up by properties["content_hash"]; misses are
+        embedded in batches of `batch_size` (Cohere's per-request limit) and
+        written to the cache.
+        """
+        batch = []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= batch_size:
+                yield from self._fill(batch)
+                batch = []
+        if batch:
+            yield from self._fill(batch)
+
+    def _fill(self, batch):
+        missing = []
+        for obj in batch:
+            obj["vector"] = self.store.get(obj["properties"]["content_hash"])
+            if obj["vector"] is None:
+                missing.append(obj)
+        if missing:
+            vectors = self.embed_documents([obj["properties"]["content"] for obj in missing])
+            for obj, vector in zip(missing, vectors):
+                obj["vector"] = vector
+            self.store.put_many(
+                [(obj["properties"]["content_hash"], obj["vector"]) for obj in missing]
+            )
+        return batch
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """The process wide cache, or None unless EMBEDDING_CACHE=1."""
+    global _cache
+    if os.environ.get("EMBEDDING_CACHE", "0") != "1":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache(
+                os.environ.get("EMBEDDING_CACHE_DIR", "embeddings"),
+                os.environ.get("COHERE_EMBED_MODEL", "embed-multilingual-v2.0"),
+            )
+        return _cache
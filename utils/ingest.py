@@ -0,0 +1,279 @@
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from langchain.schema import Document
+from pypdf import PdfReader
+
+from utils.chunking import iter_chunks
+from utils.pdf_extract import extract_pages
+from utils.weaviate import wv_sync_doc
+
+
+def spool_upload(file):
+    """Copy an uploaded file to a temporary spool file and return its path.
+
+    The caller owns the file and must remove it (see ingest_pdf).
+    """
+    fd, path = tempfile.mkstemp(suffix=".pdf", dir=os.environ.get("INGEST_SPOOL_DIR") or None)
+    with os.fdopen(fd, "wb") as buffer:
+        shutil.copyfileobj(file, buffer, length=1024 * 1024)
+    return path
+
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool(processes):
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # spawn rather than fork: the server process runs several threads
+            _process_pool = ProcessPoolExecutor(
+                max_workers=processes, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _process_pool
+
+
+def shutdown_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
+
+
+def iter_pdf_pages(path, window=50, processes=None, parallel_min_pages=None):
+    """Yield the pages of a PDF one Document at a time, in page order.
+
+    Sequentially, pypdf keeps every object it has parsed cached on the reader,
+    so a fresh reader is opened for every `window` pages to keep memory
+    bounded by the window rather than by the size of the document.
+
+    Documents with at least `parallel_min_pages` pages are split into
+    `window` sized page ranges that are extracted by a pool of `processes`
+    worker processes. At most two ranges per worker are in flight at once and
+    results are yielded in page order as they complete.
+    """
+    if processes is None:
+        # Half the cores by default, leaving the rest to the request handlers
+        processes = int(os.environ.get("INGEST_PROCESSES") or max(1, (os.cpu_count() or 2) // 2))
+    if parallel_min_pages is None:
+        parallel_min_pages = int(os.environ.get("INGEST_PARALLEL_MIN_PAGES", 100))
+
+    total = len(PdfReader(path).pages)
+    if processes > 1 and total >= parallel_min_pages:
+        pages = _iter_parallel(path, total, window, processes)
+    else:
+        pages = _iter_sequential(path, total, window)
+    for i, text in pages:
+        yield Document(page_content=text, metadata={"source": path, "page": i})
+
+
+def _iter_sequential(path, total, window):
+    for start in range(0, total, window):
+        reader = PdfReader(path)
+        for i in range(start, min(start + window, total)):
+            yield i, reader.pages[i].extract_text()
+        del reader
+
+
+def _iter_parallel(path, total, window, processes):
+    pool = get_process_pool(processes)
+    ranges = iter([(start, min(start + window, total)) for start in range(0, total, window)])
+    pending = deque()
+
+    def submit_next():
+        page_range = next(ranges, None)
+        if page_range is not None:
+            pending.append((page_range[0], pool.submit(extract_pages, path, *page_range)))
+
+    for _ in range(processes * 2):
+        submit_next()
+    try:
+        while pending:
+            start, future = pending.popleft()
+            texts = future.result()
+            submit_next()
+            for offset, text in enumerate(texts):
+                yield start + offset, text
+    finally:
+        for _, future in pending:
+            future.cancel()
+
+
+def ingest_pdf(wv_client, path, class_name, window=None, job=None, metadata=None):
+    """Stream the chunks of `path` into Weaviate and remove the spool file.
+
+    Only chunks whose content hash isn't already stored in the class are
+    uploaded, and stored chunks that no longer appear are deleted, so
+    re-uploading a revised document only embeds what changed. When an
+    IngestJob is given its counters are updated as pages are parsed and
+    batches are imported.
+    """
+    window = window or int(os.environ.get("INGEST_WINDOW_PAGES", 50))
+    pages = iter_pdf_pages(path, window)
+    callback = None
+    if job is not None:
+        pages = job.count_pages(pages)
+        callback = job.record_batch
+    chunks = iter_chunks(
+        pages,
+        size=int(os.environ.get("CHUNK_SIZE", 1000)),
+        overlap=int(os.environ.get("CHUNK_OVERLAP", 150)),
+    )
+    try:
+        result = wv_sync_doc(
+            wv_client, chunks, class_name, callback=callback, metadata=metadata
+        )
+        if job is not None:
+            job.objects_unchanged = result["unchanged"]
+            job.objects_deleted = result["deleted"]
+            job.set_report(result["report"])
+        return result
+    finally:
+        os.remove(path)
+
+
+class IngestJob:
+    def __init__(self, filename, class_name):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.class_name = class_name
+        self.status = "queued"
+        self.error = None
+        self.pages_parsed = 0
+        self.objects_imported = 0
+        self.failures = 0
+        self.objects_unchanged = 0
+        self.objects_deleted = 0
+        self.errors = []
+        self.import_objects_per_second = None
+        self.metadata = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def count_pages(self, pages):
+        for page in pages:
+            with self._lock:
+                self.pages_parsed += 1
+            yield page
+
+    def record_batch(self, results):
+        # Progress only; failed objects may still succeed on retry
+        imported = sum(
+            1 for result in results or [] if not result.get("result", {}).get("errors")
+        )
+        with self._lock:
+            self.objects_imported += imported
+
+    def set_report(self, report):
+        with self._lock:
+            self.objects_imported = report.imported
+            self.failures = len(report.errors)
+            self.errors = report.errors[:100]
+            self.import_objects_per_second = round(report.objects_per_second, 2)
+
+    def to_dict(self):
+        with self._lock:
+            end = self.finished_at or time.time()
+            elapsed = end - self.started_at if self.started_at else 0
+            return {
+                "id": self.id,
+                "filename": self.filename,
+                "weaviate_class": self.class_name,
+                "status": self.status,
+                "error": self.error,
+                "pages_parsed": self.pages_parsed,
+                "objects_imported": self.objects_imported,
+                "failures": self.failures,
+                "objects_unchanged": self.objects_unchanged,
+                "objects_deleted": self.objects_deleted,
+                "import_objects_per_second": self.import_objects_per_second,
+                "errors": self.errors,
+                "elapsed_seconds": round(elapsed, 2),
+                "objects_per_second": round(self.objects_imported / elapsed, 2) if elapsed else 0,
+            }
+
+
+class IngestJobs:
+    """Runs ingestion in the background with at most `max_workers` at a time.
+
+    Each job gets its own Weaviate client from `client_factory` because a
+    client's batch buffer can't be shared between concurrent imports. The
+    last `history` jobs are kept for the status endpoint.
+    """
+
+    def __init__(self, client_factory, max_workers=2, history=500):
+        self.client_factory = client_factory
+        self.history = history
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._jobs = OrderedDict()
+        # Spool files of jobs that haven't finished, by job id
+        self._spooled = {}
+        self._lock = threading.Lock()
+
+    def submit(self, path, class_name, filename, metadata=None, on_done=None):
+        """Queue `path` for ingestion; `on_done(job)` is called when the job
+        finishes, whether it succeeded or not."""
+        job = IngestJob(filename, class_name)
+        job.metadata = metadata
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.history:
+                self._jobs.popitem(last=False)
+        future = self._executor.submit(self._run, job, path, on_done)
+        with self._lock:
+            self._spooled[job.id] = (future, path)
+        future.add_done_callback(lambda _: self._forget(job.id))
+        return job
+
+    def _forget(self, job_id):
+        with self._lock:
+            self._spooled.pop(job_id, None)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def shutdown(self):
+        with self._lock:
+            spooled = list(self._spooled.values())
+        # Jobs that never started would leave their spool file behind
+        for future, path in spooled:
+            if future.cancel():
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logging.warning(f"Could not remove spool file {path}: {e}")
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job, path, on_done=None):
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            ingest_pdf(
+                self.client_factory(), path, job.class_name, job=job, metadata=job.metadata
+            )
+            job.status = "done"
+        except Exception as e:
+            logging.error(f"Ingestion of {job.filename} failed: {e}", exc_info=True)
+            job.status = "failed"
+            job.error = getattr(e, "detail", None) or str(e)
+        finally:
+            job.finished_at = time.time()
+            if on_done is not None:
+                try:
+                    on_done(job)
+                except Exception as e:
+                    logging.error(f"on_done for {job.filename} failed: {e}", exc_info=True)
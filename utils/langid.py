@@ -0,0 +1,84 @@
+import math
+import os
+import re
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "langid_data")
+_NON_LETTERS = re.compile(r"[^\w']+")
+_DIGITS = re.compile(r"\d+")
+
+
+def _ngrams(text, orders=(1, 2, 3)):
+    text = _DIGITS.sub("", _NON_LETTERS.sub(" ", text.lower()))
+    for word in text.split():
+        padded = f" {word} "
+        for n in orders:
+            for i in range(len(padded) - n + 1):
+                yield padded[i : i + n]
+
+
+class LanguageIdentifier:
+    """Naive Bayes over character 1-3 grams.
+
+    Trained at import from the sample texts in langid_data/<lang>.txt (the
+    language codes match utils.weaviate.PROMPTS), which takes a few
+    milliseconds; classifying an SMS is a few hundred dict lookups.
+    """
+
+    def __init__(self, samples):
+        self.languages = sorted(samples)
+        counts = {lang: {} for lang in self.languages}
+        for lang, text in samples.items():
+            for gram in _ngrams(text):
+                counts[lang][gram] = counts[lang].get(gram, 0) + 1
+        vocabulary = set().union(*counts.values())
+        self._log_probs = {}
+        self._unseen = {}
+        for lang in self.languages:
+            total = sum(counts[lang].values()) + len(vocabulary) + 1
+            self._log_probs[lang] = {
+                gram: math.log((count + 1) / total) for gram, count in counts[lang].items()
+            }
+            self._unseen[lang] = math.log(1 / total)
+
+    @classmethod
+    def load(cls, directory=DATA_DIR):
+        samples = {}
+        for name in os.listdir(directory):
+            lang, ext = os.path.splitext(name)
+            if ext == ".txt":
+                with open(os.path.join(directory, name), encoding="utf-8") as f:
+                    samples[lang] = f.read()
+        return cls(samples)
+
+    def scores(self, text):
+        """Posterior probability of each language for `text`."""
+        grams = list(_ngrams(text))
+        if not grams:
+            return {}
+        log_likelihood = {
+            lang: sum(self._log_probs[lang].get(gram, self._unseen[lang]) for gram in grams)
+            for lang in self.languages
+        }
+        best = max(log_likelihood.values())
+        weights = {lang: math.exp(value - best) for lang, value in log_likelihood.items()}
+        total = sum(weights.values())
+        return {lang: weight / total for lang, weight in weights.items()}
+
+    def detect(self, text, default, threshold=0.9):
+        """The most likely language, or `default` when it isn't at least
+        `threshold` likely (e.g. one word answers like "ok")."""
+        scores = self.scores(text)
+        if not scores:
+            return default
+        lang = max(scores, key=scores.get)
+        return lang if scores[lang] >= threshold else default
+
+
+identifier = LanguageIdentifier.load()
+
+
+def detect_language(text, default=None):
+    default = default or os.environ.get("DEFAULT_LANGUAGE", "hau")
+    return identifier.detect(
+        text, default, float(os.environ.get("LANGUAGE_DETECTION_THRESHOLD", 0.9))
+    )
@@ -0,0 +1,119 @@
+"""Copy the objects of per-file Weaviate classes into the shared collection.
+
+Run with WEAVIATE_STORAGE=shared:
+
+    python -m utils.migrate_weaviate [--delete-old]
+
+Vectors are copied as they are when the old class was embedded the same way
+as the shared collection; otherwise Weaviate re-embeds the text. Object ids
+are derived from the content hash and file, so the migration can be re-run
+safely and re-uploads afterwards only add what changed.
+"""
+import argparse
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from weaviate.util import generate_uuid5
+
+from utils import db
+from utils.chunking import content_hash
+from utils.weaviate import (
+    SHARED_CLASS,
+    BatchImporter,
+    create_wv_client,
+    schema_registry,
+    shared_storage,
+    wv_create_class,
+)
+
+
+def _cohere_config(class_schema):
+    config = class_schema.get("moduleConfig", {}).get("text2vec-cohere", {})
+    return config.get("model"), config.get("vectorizeClassName", True)
+
+
+def iter_class_objects(wv_client, class_name, properties, with_vector, page_size=200):
+    additional = ["id", "vector"] if with_vector else ["id"]
+    after = None
+    while True:
+        query = (
+            wv_client.query.get(class_name, properties)
+            .with_additional(additional)
+            .with_limit(page_size)
+        )
+        if after:
+            query = query.with_after(after)
+        objects = query.do()["data"]["Get"][class_name[0].upper() + class_name[1:]]
+        yield from objects
+        if len(objects) < page_size:
+            return
+        after = objects[-1]["_additional"]["id"]
+
+
+def migrate_file(wv_client, source, shared_schema):
+    class_name = source["weaviate_class"]
+    class_schema = wv_client.schema.get(class_name)
+    copy_vectors = (
+        _cohere_config(class_schema) == _cohere_config(shared_schema)
+        and _cohere_config(class_schema)[0] is not None
+    )
+    properties = ["content"]
+    if any(prop["name"] == "content_hash" for prop in class_schema.get("properties", [])):
+        properties.append("content_hash")
+
+    def objects():
+        for obj in iter_class_objects(wv_client, class_name, properties, copy_vectors):
+            digest = obj.get("content_hash") or content_hash(obj["content"] or "")
+            yield {
+                "class_name": SHARED_CLASS,
+                "properties": {
+                    "content": obj["content"],
+                    "content_hash": digest,
+                    "source": class_name,
+                    "organization": source["organization"],
+                    "organization_id": source["organization_id"],
+                    "file": source["file"],
+                    "shortcode": source["shortcode"],
+                },
+                "uuid": generate_uuid5(digest, class_name),
+                "vector": obj["_additional"].get("vector") if copy_vectors else None,
+            }
+
+    return BatchImporter(wv_client).run(objects())
+
+
+def migrate(delete_old=False):
+    if not shared_storage():
+        raise SystemExit("Set WEAVIATE_STORAGE=shared before migrating")
+
+    wv_client = create_wv_client()
+    if not schema_registry.exists(wv_client, SHARED_CLASS):
+        wv_create_class(wv_client, SHARED_CLASS)
+    shared_schema = wv_client.schema.get(SHARED_CLASS)
+
+    for source in db.get_file_sources():
+        class_name = source["weaviate_class"]
+        if class_name.upper() == SHARED_CLASS.upper() or not schema_registry.exists(
+            wv_client, class_name
+        ):
+            continue
+        print(f"Migrating {class_name}")
+        report = migrate_file(wv_client, source, shared_schema)
+        if report.errors:
+            print(f"{class_name}: {len(report.errors)} objects failed, keeping the old class")
+        elif delete_old:
+            wv_client.schema.delete_class(class_name)
+            schema_registry.discard(class_name)
+            print(f"Deleted {class_name}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--delete-old",
+        action="store_true",
+        help="delete each per-file class once all of its objects were copied",
+    )
+    migrate(parser.parse_args().delete_old)
@@ -0,0 +1,161 @@
+"""Apply the versioned SQL migrations in migrations/ to the database.
+
+    python -m utils.migrations
+
+Migrations are forward only: each NNNN_name.sql file (or NNNN_name.py file
+defining upgrade(cursor), for changes that need Python) runs once, in
+version order, inside its own transaction, and is recorded in
+schema_migrations. This is the only place the schema is defined; fix a
+released migration by adding a new one rather than editing it.
+"""
+import importlib.util
+import logging
+import os
+import re
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from utils import db
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "migrations")
+_FILENAME = re.compile(r"^(\d+)_(\w+)\.(sql|py)$")
+_CREATE_INDEX = re.compile(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.I)
+
+# Any fixed number; only one process migrates at a time
+_LOCK_ID = 7421001
+
+
+def _load_upgrade(path):
+    spec = importlib.util.spec_from_file_location(
+        f"migrations.{os.path.basename(path)[:-3]}", path
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.upgrade
+
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    """(version, name, source) for every migration file, in version order.
+
+    `source` is the SQL text of a .sql migration or the path of a .py one.
+    """
+    migrations = []
+    for filename in os.listdir(directory):
+        match = _FILENAME.match(filename)
+        if match:
+            path = os.path.join(directory, filename)
+            if match.group(3) == "py":
+                source = path
+            else:
+                with open(path, encoding="utf-8") as f:
+                    source = f.read()
+            migrations.append((int(match.group(1)), match.group(2), source))
+    migrations.sort()
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError(f"Duplicate migration versions in {directory}")
+    return migrations
+
+
+def _ensure_table(cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations
+        (version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMPTZ NOT NULL DEFAULT now())
+        """
+    )
+
+
+def applied_versions(cursor):
+    _ensure_table(cursor)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row["version"] for row in cursor.fetchall()}
+
+
+def run_migrations():
+    """Apply every pending migration; returns the versions applied."""
+    applied = []
+    conn = db.create_connection()
+    cursor = conn.cursor()
+    try:
+        for version, name, source in load_migrations():
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (_LOCK_ID,))
+            if version in applied_versions(cursor):
+                conn.commit()
+                continue
+            print(f"Applying migration {version:04d}_{name}")
+            if source.endswith(".py"):
+                _load_upgrade(source)(cursor)
+            else:
+                cursor.execute(source)
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                (version, name),
+            )
+            conn.commit()
+            applied.append(version)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return applied
+
+
+def check_schema():
+    """Pending migrations and indexes they create that are missing.
+
+    Read only: a database without schema_migrations has every migration
+    pending.
+    """
+    migrations = load_migrations()
+    expected = [
+        index.lower() for _, _, sql in migrations for index in _CREATE_INDEX.findall(sql)
+    ]
+    conn = db.create_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT to_regclass('schema_migrations') IS NOT NULL AS exists")
+        if cursor.fetchone()["exists"]:
+            cursor.execute("SELECT version FROM schema_migrations")
+            applied = {row["version"] for row in cursor.fetchall()}
+        else:
+            applied = set()
+        cursor.execute(
+            "SELECT indexname FROM pg_indexes WHERE indexname = ANY(%s)", (expected,)
+        )
+        existing = {row["indexname"] for row in cursor.fetchall()}
+        conn.commit()
+    finally:
+        conn.close()
+    return {
+        "pending": [
+            f"{version:04d}_{name}" for version, name, _ in migrations if version not in applied
+        ],
+        "missing_indexes": [index for index in expected if index not in existing],
+    }
+
+
+def report_schema():
+    """Log pending migrations and missing indexes (run at startup)."""
+    try:
+        status = check_schema()
+    except Exception as e:
+        logging.error(f"Could not check the database schema: {e}")
+        return None
+    if status["pending"]:
+        logging.warning(
+            f"Pending migrations: {', '.join(status['pending'])}; run python -m utils.migrations"
+        )
+    if status["missing_indexes"]:
+        logging.warning(f"Missing indexes: {', '.join(status['missing_indexes'])}")
+    return status
+
+
+if __name__ == "__main__":
+    applied = run_migrations()
+    print(f"Applied {len(applied)} migration(s)" if applied else "Database is up to date")
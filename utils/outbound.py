@@ -0,0 +1,276 @@
+import logging
+import os
+import threading
+import time
+
+from utils import db
+from utils.africastalking import AfricasTalking
+from utils.sms_encoding import encode_sms
+
+# AfricasTalking per-recipient status codes worth retrying
+# (InternalServerError, GatewayError, RejectedByGateway)
+TRANSIENT_STATUS_CODES = {500, 501, 502}
+SENT_STATUS_CODES = {100, 101, 102}
+
+# Queue priorities: replies are claimed before broadcasts
+REPLY_PRIORITY = 0
+BROADCAST_PRIORITY = 1
+
+
+def queue_enabled():
+    return os.environ.get("OUTBOUND_QUEUE", "0") == "1"
+
+
+class SegmentStats:
+    """Running totals of what outbound messages cost in billed segments."""
+
+    def __init__(self):
+        self._counts = {
+            "messages": 0,
+            "recipients": 0,
+            "segments": 0,
+            "ucs2_messages": 0,
+            "transliterated": 0,
+            "trimmed": 0,
+        }
+        self._lock = threading.Lock()
+
+    def record(self, info, recipients):
+        with self._lock:
+            self._counts["messages"] += 1
+            self._counts["recipients"] += recipients
+            self._counts["segments"] += info["segments"] * recipients
+            self._counts["ucs2_messages"] += info["encoding"] == "ucs2"
+            self._counts["transliterated"] += info["transliterated"]
+            self._counts["trimmed"] += info["trimmed"]
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+segment_stats = SegmentStats()
+
+
+def prepare(message, max_segments):
+    """Encode `message` for the fewest billed segments (see encode_sms)."""
+    return encode_sms(
+        message,
+        max_segments,
+        allow_transliteration=os.environ.get("SMS_TRANSLITERATE", "1") == "1",
+    )
+
+
+def reply_max_segments():
+    return int(os.environ.get("SMS_MAX_SEGMENTS", 2))
+
+
+def broadcast_max_segments():
+    # 0 leaves broadcasts untrimmed: they're written by the organisation
+    return int(os.environ.get("BROADCAST_MAX_SEGMENTS", 0))
+
+
+def send_sms(sender, message, recipients):
+    """Send now, or queue for the dispatcher when OUTBOUND_QUEUE=1.
+
+    Either way the message is stored in outbound_sms with its segment count.
+    """
+    message, info = prepare(message, reply_max_segments())
+    segment_stats.record(info, len(recipients))
+    if queue_enabled():
+        return db.enqueue_sms(
+            sender,
+            message,
+            recipients,
+            _batch_size(),
+            info["segments"],
+            info["encoding"],
+            REPLY_PRIORITY,
+        )
+    try:
+        response = AfricasTalking().send(sender, message, recipients)
+    except Exception as e:
+        _record(sender, message, recipients, "failed", info, getattr(e, "detail", str(e)))
+        raise
+    _record(sender, message, recipients, "sent", info)
+    return response
+
+
+def _record(sender, message, recipients, status, info, detail=None):
+    # Losing the log entry shouldn't fail a reply that already went out
+    try:
+        db.record_sms(
+            sender, message, recipients, status, info["segments"], info["encoding"], detail
+        )
+    except Exception as e:
+        logging.error(f"Failed to record outbound SMS: {e}")
+
+
+def broadcast(sender, message, recipients):
+    """Returns (one summary dict per chunk or queued job, encoding info)."""
+    message, info = prepare(message, broadcast_max_segments())
+    segment_stats.record(info, len(recipients))
+    if queue_enabled():
+        job_ids = db.enqueue_sms(
+            sender,
+            message,
+            recipients,
+            _batch_size(),
+            info["segments"],
+            info["encoding"],
+            BROADCAST_PRIORITY,
+        )
+        return [
+            {"job": job_id, "status": "queued"} for job_id in job_ids
+        ], info
+    return AfricasTalking().broadcast(sender, message, recipients), info
+
+
+def _batch_size():
+    return int(os.environ.get("OUTBOUND_BATCH_SIZE", 500))
+
+
+class TokenBucket:
+    """Allows `rate` tokens per second with bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        # A request bigger than the bucket waits for a full bucket and then
+        # overdraws it, which delays the requests after it accordingly.
+        needed = min(tokens, self.capacity)
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= needed:
+                    self._tokens -= tokens
+                    return
+                time.sleep((needed - self._tokens) / self.rate)
+
+
+class OutboundDispatcher:
+    """Drains the outbound_sms table, throttled by a token bucket.
+
+    Each claim holds at most one provider request of `batch_size`
+    recipients, fewer when the bucket couldn't send that many well inside
+    `stale_after` (after which another dispatcher would reclaim the jobs),
+    so replies queued meanwhile wait for one batch rather than a whole
+    broadcast. Claimed jobs with the same sender and message are merged into
+    one request. Failed sends and recipients rejected with a transient status
+    go back to pending with exponential backoff until `max_attempts`, after
+    which the job is marked failed.
+    """
+
+    def __init__(
+        self,
+        rate=10,
+        burst=100,
+        batch_size=500,
+        max_attempts=5,
+        poll_interval=1,
+        stale_after=600,
+    ):
+        self.bucket = TokenBucket(rate, burst)
+        self.batch_size = batch_size
+        self.stale_after = stale_after
+        self.claim_size = max(1, min(batch_size, int(rate * stale_after / 2)))
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.sms = AfricasTalking.sms
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="outbound-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                jobs = db.claim_sms_jobs(self.claim_size, self.stale_after)
+            except Exception as e:
+                logging.error(f"Failed to claim outbound SMS jobs: {e}")
+                jobs = []
+            if not jobs:
+                self._stop.wait(self.poll_interval)
+                continue
+            for batch in self._batches(jobs):
+                try:
+                    self._send(batch)
+                except Exception as e:
+                    # Jobs left in 'sending' are reclaimed once they go stale
+                    logging.error(
+                        f"Outbound SMS batch {[job['id'] for job in batch]} failed: {e}",
+                        exc_info=True,
+                    )
+
+    def _batches(self, jobs):
+        groups = {}
+        for job in jobs:
+            groups.setdefault((job["sender"], job["message"]), []).append(job)
+        for group in groups.values():
+            batch, size = [], 0
+            for job in group:
+                if batch and size + len(job["recipients"]) > self.batch_size:
+                    yield batch
+                    batch, size = [], 0
+                batch.append(job)
+                size += len(job["recipients"])
+            if batch:
+                yield batch
+
+    def _send(self, jobs):
+        sender, message = jobs[0]["sender"], jobs[0]["message"]
+        recipients = [number for job in jobs for number in job["recipients"]]
+        self.bucket.acquire(len(recipients))
+        try:
+            response = self.sms.send(message, recipients, sender)
+        except Exception as e:
+            for job in jobs:
+                self._retry(job, job["recipients"], str(e))
+            return
+
+        statuses = {
+            r.get("number"): r.get("statusCode")
+            for r in (response or {}).get("SMSMessageData", {}).get("Recipients", [])
+        }
+        for job in jobs:
+            transient, rejected = [], []
+            for number in job["recipients"]:
+                code = statuses.get(number)
+                if code is None or code in SENT_STATUS_CODES:
+                    continue
+                (transient if code in TRANSIENT_STATUS_CODES else rejected).append(
+                    f"{number}:{code}"
+                )
+            detail = ", ".join(rejected) or None
+            if transient:
+                self._retry(
+                    job,
+                    [n.rsplit(":", 1)[0] for n in transient],
+                    ", ".join(transient + rejected),
+                )
+            else:
+                db.update_sms_job(job["id"], "sent", detail)
+
+    def _retry(self, job, recipients, error):
+        if job["attempts"] >= self.max_attempts:
+            logging.error(f"Outbound SMS job {job['id']} failed: {error}")
+            db.update_sms_job(job["id"], "failed", error, recipients)
+            return
+        retry_in = min(2 ** job["attempts"], 300)
+        db.update_sms_job(job["id"], "pending", error, recipients, retry_in)
@@ -0,0 +1,13 @@
+"""Page text extraction run in the ingest worker processes.
+
+Workers are spawned and import only this module, so keep its imports to
+pypdf: pulling in langchain or the Weaviate client here would be paid for
+in every worker.
+"""
+from pypdf import PdfReader
+
+
+def extract_pages(path, start, stop):
+    # A reader per range keeps workers independent
+    reader = PdfReader(path)
+    return [reader.pages[i].extract_text() for i in range(start, stop)]
@@ -0,0 +1,34 @@
+import os
+import re
+
+_SEPARATORS = re.compile(r"[\s\-().]")
+_E164 = re.compile(r"^\+[1-9]\d{7,14}$")
+
+
+def normalize_number(number):
+    """Return `number` in E.164 form (e.g. +2348162577778).
+
+    Local numbers starting with a single 0 get DEFAULT_COUNTRY_CODE (234) as
+    their prefix and a leading international 00 is treated as +. Raises
+    ValueError for anything that doesn't end up as a valid E.164 number.
+    """
+    country_code = os.environ.get("DEFAULT_COUNTRY_CODE", "234")
+    cleaned = _SEPARATORS.sub("", str(number))
+
+    if cleaned.startswith("00"):
+        cleaned = "+" + cleaned[2:]
+    elif cleaned.startswith("0"):
+        cleaned = f"+{country_code}{cleaned[1:]}"
+    elif not cleaned.startswith("+"):
+        cleaned = "+" + cleaned
+
+    if not _E164.match(cleaned):
+        raise ValueError(f"Invalid phone number: {number}")
+    return cleaned
+
+
+def split_numbers(numbers):
+    """Split a comma separated string of numbers and normalize each of them."""
+    if isinstance(numbers, str):
+        numbers = numbers.split(",")
+    return [normalize_number(n) for n in numbers if str(n).strip()]
@@ -0,0 +1,188 @@
+import threading
+import time
+
+from psycopg2 import extensions
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PooledConnection:
+    """Thin proxy around a psycopg2 connection borrowed from a ConnectionPool.
+
+    Everything is delegated to the real connection except close(), which hands
+    the connection back to the pool instead of tearing it down, so the existing
+    `conn = create_connection() ... conn.close()` helpers keep working as-is.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+        self._returned = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if not self._returned:
+            self._returned = True
+            self._pool.putconn(self._conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self._conn.commit()
+            else:
+                self._conn.rollback()
+        finally:
+            self.close()
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of psycopg2 connections.
+
+    At most `max_size` connections are ever open; callers beyond that wait up to
+    `timeout` seconds for one to be returned. Connections older than
+    `max_lifetime` seconds are recycled, and a connection that has sat idle for
+    longer than `health_check_interval` seconds is pinged with `SELECT 1` before
+    being handed out again.
+    """
+
+    def __init__(
+        self,
+        connect,
+        min_size=1,
+        max_size=10,
+        max_lifetime=1800,
+        health_check_interval=30,
+        timeout=10,
+    ):
+        if max_size < 1 or min_size > max_size:
+            raise ValueError("Invalid pool size")
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.health_check_interval = health_check_interval
+        self.timeout = timeout
+
+        self._cond = threading.Condition()
+        self._idle = []  # (conn, last_used)
+        self._created = {}  # id(conn) -> created_at
+        self._size = 0
+        self._filled = False
+
+    def getconn(self):
+        self._fill()
+        deadline = time.monotonic() + self.timeout
+        while True:
+            conn, last_used = None, None
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(
+                            f"No database connection available after {self.timeout}s"
+                        )
+                    self._cond.wait(remaining)
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                else:
+                    self._size += 1
+
+            if conn is None:
+                return PooledConnection(self, self._open())
+            if self._usable(conn, last_used):
+                return PooledConnection(self, conn)
+            self._discard(conn)
+
+    def putconn(self, conn):
+        if not conn.closed and self._expired(conn):
+            self._discard(conn)
+            return
+        if not conn.closed and (
+            conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE
+        ):
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+        if conn.closed:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            return {"size": self._size, "idle": len(self._idle), "max_size": self.max_size}
+
+    def _fill(self):
+        if self._filled:
+            return
+        with self._cond:
+            if self._filled:
+                return
+            self._filled = True
+            missing = max(self.min_size - self._size, 0)
+            self._size += missing
+        opened = []
+        try:
+            for _ in range(missing):
+                opened.append(self._open(reserved=False))
+        finally:
+            with self._cond:
+                self._size -= missing - len(opened)
+                now = time.monotonic()
+                self._idle.extend((conn, now) for conn in opened)
+                self._cond.notify_all()
+
+    def _open(self, reserved=True):
+        try:
+            conn = self._connect()
+        except Exception:
+            if reserved:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+            raise
+        self._created[id(conn)] = time.monotonic()
+        return conn
+
+    def _expired(self, conn):
+        created_at = self._created.get(id(conn), 0)
+        return time.monotonic() - created_at > self.max_lifetime
+
+    def _usable(self, conn, last_used):
+        if conn.closed or self._expired(conn):
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn):
+        self._created.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
@@ -0,0 +1,86 @@
+import logging
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+
+def pack_number(number):
+    # E.164 numbers are at most 15 digits, so they fit in an unsigned 64-bit int
+    return int(number.lstrip("+"))
+
+
+class SenderRegistry:
+    """In-memory set of registered sender numbers.
+
+    Numbers are kept as a sorted array of packed 64-bit integers (8 bytes per
+    number) and looked up with a binary search, so checking a sender never
+    needs a database round-trip. Lookups are lock free; writers take a lock.
+    """
+
+    def __init__(self):
+        self._numbers = array("Q")
+        self._lock = threading.Lock()
+        self.loaded = False
+        self.loaded_at = None
+
+    def load(self, numbers):
+        packed = array("Q", sorted({pack_number(n) for n in numbers}))
+        with self._lock:
+            self._numbers = packed
+            self.loaded = True
+            self.loaded_at = time.time()
+
+    def add(self, numbers):
+        with self._lock:
+            for value in map(pack_number, numbers):
+                i = bisect_left(self._numbers, value)
+                if i == len(self._numbers) or self._numbers[i] != value:
+                    self._numbers.insert(i, value)
+
+    def discard(self, numbers):
+        with self._lock:
+            for value in map(pack_number, numbers):
+                i = bisect_left(self._numbers, value)
+                if i < len(self._numbers) and self._numbers[i] == value:
+                    del self._numbers[i]
+
+    def __contains__(self, number):
+        numbers = self._numbers
+        value = pack_number(number)
+        i = bisect_left(numbers, value)
+        return i < len(numbers) and numbers[i] == value
+
+    def __len__(self):
+        return len(self._numbers)
+
+    def stats(self):
+        return {
+            "loaded": self.loaded,
+            "loaded_at": self.loaded_at,
+            "size": len(self._numbers),
+            "bytes": self._numbers.itemsize * len(self._numbers),
+        }
+
+
+registered_senders = SenderRegistry()
+
+
+def start_refresh(loader, interval):
+    """Reload the registry from `loader()` every `interval` seconds.
+
+    Local writes update the registry straight away; the periodic reload picks
+    up numbers changed by other workers or directly in the database.
+    """
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                registered_senders.load(loader())
+            except Exception as e:
+                logging.error(f"Failed to refresh registered senders: {e}")
+
+    thread = threading.Thread(target=run, name="sender-registry-refresh", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,134 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from utils import db
+
+_TURN = "\x1e"
+_FIELD = "\x1f"
+# Rough per-sender cost of the OrderedDict slot, key string and tuple
+_ENTRY_OVERHEAD = 200
+
+
+def encode_turns(turns):
+    return _TURN.join(f"{question}{_FIELD}{answer}" for question, answer in turns).encode("utf-8")
+
+
+def decode_turns(blob):
+    if not blob:
+        return []
+    return [tuple(turn.split(_FIELD, 1)) for turn in blob.decode("utf-8").split(_TURN)]
+
+
+class SessionStore:
+    """Recent (question, answer) turns per conversation, kept in memory.
+
+    Each conversation keeps at most `max_turns` turns, each side cut to
+    `max_chars`, packed into a single UTF-8 bytes object. Conversations
+    expire `ttl` seconds after their last turn and the least recently used
+    are evicted once the store holds more than `max_bytes`, so memory stays
+    flat however many senders are active.
+    """
+
+    def __init__(self, max_turns=3, ttl=1800, max_bytes=64 * 1024 * 1024, max_chars=320):
+        self.max_turns = max_turns
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_chars = max_chars
+        self.evictions = 0
+        self._bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return []
+            blob, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                return []
+            return decode_turns(blob)
+
+    def append(self, key, question, answer):
+        turns = self.get(key)
+        turns.append((question[: self.max_chars], answer[: self.max_chars]))
+        blob = encode_turns(turns[-self.max_turns :])
+        now = time.monotonic()
+        with self._lock:
+            self._remove(key)
+            self._data[key] = (blob, now + self.ttl)
+            self._bytes += len(blob) + _ENTRY_OVERHEAD
+            # Entries are ordered by last turn, so expired ones are at the front
+            while self._data:
+                oldest, (oldest_blob, expires_at) = next(iter(self._data.items()))
+                if expires_at > now and self._bytes <= self.max_bytes:
+                    break
+                if expires_at > now:
+                    self.evictions += 1
+                self._remove(oldest)
+
+    def clear(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[0]) + _ENTRY_OVERHEAD
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "memory",
+                "conversations": len(self._data),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+            }
+
+
+class PostgresSessionStore:
+    """Same interface as SessionStore, persisted in the conversations table
+    so history survives restarts and is shared between server processes."""
+
+    def __init__(self, max_turns=3, ttl=1800, max_chars=320, purge_every=1000):
+        self.max_turns = max_turns
+        self.ttl = ttl
+        self.max_chars = max_chars
+        self.purge_every = purge_every
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return decode_turns(db.get_conversation(key, self.ttl))
+
+    def append(self, key, question, answer):
+        turns = self.get(key)
+        turns.append((question[: self.max_chars], answer[: self.max_chars]))
+        db.save_conversation(key, encode_turns(turns[-self.max_turns :]))
+        with self._lock:
+            self._writes += 1
+            purge = self._writes % self.purge_every == 0
+        if purge:
+            db.purge_conversations(self.ttl)
+
+    def clear(self, key):
+        db.delete_conversation(key)
+
+    def stats(self):
+        return {"backend": "postgres", "ttl": self.ttl}
+
+
+def create_session_store():
+    max_turns = int(os.environ.get("SESSION_TURNS", 3))
+    ttl = int(os.environ.get("SESSION_TTL_SECONDS", 1800))
+    if os.environ.get("SESSION_BACKEND", "memory") == "postgres":
+        return PostgresSessionStore(max_turns, ttl)
+    return SessionStore(
+        max_turns,
+        ttl,
+        max_bytes=int(os.environ.get("SESSION_MEMORY_MB", 64)) * 1024 * 1024,
+    )
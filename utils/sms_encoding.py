@@ -0,0 +1,117 @@
+import unicodedata
+
+# GSM 03.38 default alphabet and the extension table (sent as ESC + char,
+# so two septets each)
+GSM7_BASIC = set(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+GSM7_EXTENDED = set("^{}\\[~]|€\f")
+
+SINGLE_SEGMENT = {"gsm7": 160, "ucs2": 70}
+MULTI_SEGMENT = {"gsm7": 153, "ucs2": 67}
+
+# Replacements that keep the meaning: Hausa hooked letters are commonly
+# written without the hook, typographic punctuation has a plain ASCII form.
+TRANSLITERATIONS = {
+    "ƙ": "k", "Ƙ": "K",
+    "ɗ": "d", "Ɗ": "D",
+    "ɓ": "b", "Ɓ": "B",
+    "ƴ": "y", "Ƴ": "Y",
+    "ʼ": "'", "‘": "'", "’": "'", "ʻ": "'", "`": "'",
+    "“": '"', "”": '"', "«": '"', "»": '"',
+    "–": "-", "—": "-", "‐": "-",
+    "…": "...", " ": " ", "\t": " ",
+}
+
+
+def is_gsm7(text):
+    return all(char in GSM7_BASIC or char in GSM7_EXTENDED for char in text)
+
+
+def _units(text, encoding):
+    # Septets for GSM-7, UTF-16 code units for UCS-2; a character's units are
+    # never split across two segments
+    if encoding == "gsm7":
+        return [2 if char in GSM7_EXTENDED else 1 for char in text]
+    return [2 if ord(char) > 0xFFFF else 1 for char in text]
+
+
+def count_segments(text, encoding=None):
+    encoding = encoding or ("gsm7" if is_gsm7(text) else "ucs2")
+    units = _units(text, encoding)
+    if sum(units) <= SINGLE_SEGMENT[encoding]:
+        return 1 if text else 0
+    segments, used = 1, 0
+    for size in units:
+        if used + size > MULTI_SEGMENT[encoding]:
+            segments, used = segments + 1, 0
+        used += size
+    return segments
+
+
+def transliterate(text):
+    """Replace characters outside GSM-7 by their closest GSM-7 form where
+    one exists (accents are stripped unless the accented letter is GSM-7)."""
+    chars = []
+    for char in text:
+        if char in GSM7_BASIC or char in GSM7_EXTENDED:
+            chars.append(char)
+        elif char in TRANSLITERATIONS:
+            chars.append(TRANSLITERATIONS[char])
+        else:
+            base = "".join(
+                c for c in unicodedata.normalize("NFKD", char) if not unicodedata.combining(c)
+            )
+            chars.append(base if base and is_gsm7(base) else char)
+    return "".join(chars)
+
+
+def trim_to_segments(text, max_segments, encoding, suffix="..."):
+    """Cut `text` on a word boundary so it fits in `max_segments`."""
+    if count_segments(text, encoding) <= max_segments:
+        return text
+    words = text.split(" ")
+    low, high = 0, len(words)
+    # Longest prefix of whole words that fits with the suffix
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_segments(" ".join(words[:middle]) + suffix, encoding) <= max_segments:
+            low = middle
+        else:
+            high = middle - 1
+    if low:
+        return " ".join(words[:low]).rstrip(" ,;:") + suffix
+    # A single word longer than the limit: cut it by character instead
+    capacity = SINGLE_SEGMENT[encoding] if max_segments == 1 else MULTI_SEGMENT[encoding] * max_segments
+    text = text[: capacity - len(suffix)]
+    while text and count_segments(text + suffix, encoding) > max_segments:
+        text = text[:-1]
+    return text + suffix
+
+
+def encode_sms(text, max_segments=None, allow_transliteration=True):
+    """Prepare `text` for sending as few billed segments as possible.
+
+    When transliteration is allowed and makes the whole text GSM-7 (160
+    characters per segment instead of UCS-2's 70) the transliterated text is
+    used; otherwise the original characters are kept. With `max_segments`
+    the text is then trimmed on a word boundary to fit. Returns the text and
+    a dict describing its encoding and segment count.
+    """
+    info = {"transliterated": False, "trimmed": False}
+    text = text.strip()
+    if allow_transliteration and not is_gsm7(text):
+        candidate = transliterate(text)
+        if is_gsm7(candidate):
+            text = candidate
+            info["transliterated"] = True
+    encoding = "gsm7" if is_gsm7(text) else "ucs2"
+    if max_segments:
+        trimmed = trim_to_segments(text, max_segments, encoding)
+        info["trimmed"] = trimmed != text
+        text = trimmed
+    info["encoding"] = encoding
+    info["characters"] = len(text)
+    info["segments"] = count_segments(text, encoding)
+    return text, info
@@ -0,0 +1,66 @@
+import logging
+import queue
+import threading
+
+
+class SmsWorkerPool:
+    """Fixed pool of threads answering inbound SMS taken from a bounded queue.
+
+    The /sms webhook only validates and enqueues the message, so its latency
+    no longer depends on retrieval, generation or the reply send.
+    """
+
+    def __init__(self, handler, workers=4, queue_size=1000):
+        self.handler = handler
+        self.workers = workers
+        self.processed = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"sms-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, *args):
+        """Queue a message; returns False when the queue is full."""
+        try:
+            self._queue.put_nowait(args)
+            return True
+        except queue.Full:
+            return False
+
+    def stop(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queued": self._queue.qsize(),
+                "processed": self.processed,
+                "failed": self.failed,
+            }
+
+    def _run(self):
+        while True:
+            args = self._queue.get()
+            if args is None:
+                break
+            try:
+                self.handler(*args)
+                with self._lock:
+                    self.processed += 1
+            except Exception as e:
+                logging.error(f"Failed to process SMS: {e}", exc_info=True)
+                with self._lock:
+                    self.failed += 1
+            finally:
+                self._queue.task_done()
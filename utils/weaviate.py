@@ -1,51 +1,468 @@
 import json
+import logging
+import os
+import threading
+import time
 from fastapi import HTTPException
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, List, Optional
 from langchain.chains import ConversationalRetrievalChain
+from langchain.llms.cohere import Cohere
 from langchain.prompts import PromptTemplate
+from langchain.schema import BaseRetriever, Document
+import weaviate
+from utils.chunking import content_hash
+from utils.context import build_context
+from utils.embedding_cache import get_embedding_cache
+from requests.exceptions import RequestException
+from weaviate.exceptions import UnexpectedStatusCodeException, WeaviateBaseError
+from weaviate.util import generate_uuid5
 
 
-def wv_upload_doc(wv_client, doc, class_name):
-    try:
-        wv_client.batch.configure(batch_size=300)
-        with wv_client.batch as batch:
-            for i, d in enumerate(doc):
-                print(f"importing question: {i+1}")
-                properties = {"content": d.page_content}
-                batch.add_data_object(data_object=properties, class_name=class_name)
-        print(f"File uploaded successfully")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail="Failed add file")
+class SchemaRegistry:
+    """Known Weaviate class names, so existence checks don't fetch the schema.
+
+    The full schema is only fetched on first use and then every
+    `refresh_interval` seconds; classes created or deleted through this module
+    update the set straight away.
+    """
+
+    def __init__(self, refresh_interval=600):
+        self.refresh_interval = refresh_interval
+        self._classes = set()
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def refresh(self, wv_client):
+        classes = {row["class"].upper() for row in wv_client.schema.get()["classes"]}
+        with self._lock:
+            self._classes = classes
+            self._loaded_at = time.monotonic()
+
+    def exists(self, wv_client, class_name):
+        if (
+            self._loaded_at is None
+            or time.monotonic() - self._loaded_at > self.refresh_interval
+        ):
+            self.refresh(wv_client)
+        return class_name.upper() in self._classes
+
+    def add(self, class_name):
+        with self._lock:
+            self._classes.add(class_name.upper())
+
+    def discard(self, class_name):
+        with self._lock:
+            self._classes.discard(class_name.upper())
+
+
+schema_registry = SchemaRegistry(
+    float(os.environ.get("WEAVIATE_SCHEMA_REFRESH_SECONDS", 600))
+)
+
+
+# "per_file" keeps one Weaviate class per uploaded file; "shared" stores every
+# file in one collection and tells them apart by their `source` property,
+# which holds the file's logical class name (files.weaviate_class).
+STORAGE_MODE = os.environ.get("WEAVIATE_STORAGE", "per_file")
+SHARED_CLASS = os.environ.get("WEAVIATE_SHARED_CLASS", "Document")
+
+
+def shared_storage():
+    return STORAGE_MODE == "shared"
+
+
+def physical_class(class_name):
+    """The Weaviate class that holds the objects of logical class `class_name`."""
+    return SHARED_CLASS if shared_storage() else class_name
+
+
+def source_filter(class_name):
+    return {"path": ["source"], "operator": "Equal", "valueText": class_name}
+
+
+def create_wv_client(timeout_config=(10, 60)):
+    return weaviate.Client(
+        url=os.environ.get("WEAVIATE_URL"),
+        auth_client_secret=weaviate.AuthApiKey(api_key=os.environ.get("WEAVIATE_API_KEY")),
+        timeout_config=timeout_config,
+        additional_headers={"X-Cohere-Api-Key": os.environ.get("COHERE_API_KEY")},
+    )
+
+
+def retrieval_timeout():
+    return float(os.environ.get("RETRIEVAL_TIMEOUT", 3))
+
+
+def create_retrieval_client():
+    """Client for answer time searches. Its requests give up after
+    RETRIEVAL_TIMEOUT, so a slow class frees its retrieval thread instead of
+    holding it for the default 60 seconds."""
+    timeout = retrieval_timeout()
+    return create_wv_client(timeout_config=(min(timeout, 10), timeout))
+
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.retried = 0
+        self.errors = []  # {"id": ..., "error": ...} for objects that never made it
+        self.elapsed = 0.0
+
+    @property
+    def objects_per_second(self):
+        return self.imported / self.elapsed if self.elapsed else 0.0
+
+    def to_dict(self):
+        return {
+            "imported": self.imported,
+            "failed": len(self.errors),
+            "retried": self.retried,
+            "elapsed_seconds": round(self.elapsed, 2),
+            "objects_per_second": round(self.objects_per_second, 2),
+            "errors": self.errors[:100],
+        }
+
+
+class BatchImporter:
+    """Weaviate batch import with dynamic batch sizing and concurrent workers.
+
+    Every object's result is checked in the batch callback; objects that fail
+    (or whose batch never came back) are retried on their own up to
+    `max_retries` times, and whatever still fails ends up in the report.
+    Objects are only held in memory until their batch result arrives.
+    """
+
+    def __init__(self, wv_client, batch_size=None, num_workers=None, max_retries=None, dynamic=True, on_results=None):
+        self.wv_client = wv_client
+        self.batch_size = batch_size or int(os.environ.get("WEAVIATE_BATCH_SIZE", 100))
+        self.num_workers = num_workers or int(os.environ.get("WEAVIATE_BATCH_WORKERS", 2))
+        self.max_retries = (
+            int(os.environ.get("WEAVIATE_BATCH_RETRIES", 2)) if max_retries is None else max_retries
+        )
+        self.dynamic = dynamic
+        self.on_results = on_results
+        self._lock = threading.Lock()
+
+    def run(self, objects):
+        """Import dicts with class_name, properties, uuid and optional vector."""
+        report = ImportReport()
+        started = time.monotonic()
+        failed = self._import(objects, report)
+        for _ in range(self.max_retries):
+            if not failed:
+                break
+            report.retried += len(failed)
+            failed = self._import((obj for obj, _ in failed.values()), report)
+        report.errors = [{"id": uuid, "error": error} for uuid, (_, error) in failed.items()]
+        report.elapsed = time.monotonic() - started
+        print(
+            f"Imported {report.imported} objects ({len(report.errors)} failed) "
+            f"in {report.elapsed:.1f}s, {report.objects_per_second:.1f} objects/s"
+        )
+        return report
+
+    def _import(self, objects, report):
+        pending, failed = {}, {}
+
+        def callback(results):
+            with self._lock:
+                for result in results or []:
+                    uuid = result.get("id")
+                    obj = pending.pop(uuid, None)
+                    errors = result.get("result", {}).get("errors")
+                    if errors:
+                        message = "; ".join(
+                            e.get("message", "") for e in errors.get("error", [])
+                        ) or json.dumps(errors)
+                        failed[uuid] = (obj, message)
+                    else:
+                        report.imported += 1
+            if self.on_results is not None:
+                self.on_results(results)
+
+        self.wv_client.batch.configure(
+            batch_size=self.batch_size,
+            dynamic=self.dynamic,
+            num_workers=self.num_workers,
+            timeout_retries=3,
+            connection_error_retries=3,
+            callback=callback,
+        )
+        # Only Weaviate errors are handled here; errors producing the objects
+        # (PDF parsing, chunking, embedding) are raised to the caller once
+        # the objects added so far have been flushed.
+        objects, source_error = iter(objects), None
+        try:
+            with self.wv_client.batch as batch:
+                while True:
+                    try:
+                        obj = next(objects)
+                    except StopIteration:
+                        break
+                    except Exception as e:
+                        source_error = e
+                        break
+                    with self._lock:
+                        pending[obj["uuid"]] = obj
+                    batch.add_data_object(
+                        data_object=obj["properties"],
+                        class_name=obj["class_name"],
+                        uuid=obj["uuid"],
+                        vector=obj.get("vector"),
+                    )
+        except (WeaviateBaseError, RequestException) as e:
+            print(f"Batch import error: {e}")
+        if source_error is not None:
+            raise source_error
+        # Objects whose batch result never arrived are retried as well
+        with self._lock:
+            for uuid, obj in pending.items():
+                failed.setdefault(uuid, (obj, "No result returned for object"))
+        return failed
+
+
+# Stored for incremental re-ingestion only, so it must not be vectorized
+CONTENT_HASH_PROPERTY = {
+    "name": "content_hash",
+    "dataType": ["text"],
+    "tokenization": "field",
+    "moduleConfig": {
+        "text2vec-cohere": {"skip": True, "vectorizePropertyName": False},
+    },
+}
+
+
+def _metadata_property(name, data_type="text"):
+    prop = {
+        "name": name,
+        "dataType": [data_type],
+        "moduleConfig": {
+            "text2vec-cohere": {"skip": True, "vectorizePropertyName": False},
+        },
+    }
+    if data_type == "text":
+        prop["tokenization"] = "field"
+    return prop
+
+
+# Extra properties of the shared collection, used to filter retrieval
+SHARED_PROPERTIES = [
+    _metadata_property("source"),
+    _metadata_property("organization"),
+    _metadata_property("organization_id", "int"),
+    _metadata_property("file"),
+    _metadata_property("shortcode"),
+]
+
+
+def wv_existing_hashes(wv_client, class_name, page_size=500):
+    """Map object id -> content_hash for every object in `class_name`."""
+    if shared_storage():
+        return _existing_shared_hashes(wv_client, class_name, page_size)
+    existing, after = {}, None
+    while True:
+        query = (
+            wv_client.query.get(class_name, ["content_hash"])
+            .with_additional(["id"])
+            .with_limit(page_size)
+        )
+        if after:
+            query = query.with_after(after)
+        objects = query.do()["data"]["Get"][class_name[0].upper() + class_name[1:]]
+        for obj in objects:
+            existing[obj["_additional"]["id"]] = obj.get("content_hash")
+        if len(objects) < page_size:
+            return existing
+        after = objects[-1]["_additional"]["id"]
+
+
+def _existing_shared_hashes(wv_client, class_name, page_size):
+    # The cursor API can't be combined with a filter, so page by content_hash
+    existing, last = {}, None
+    while True:
+        where = source_filter(class_name)
+        if last is not None:
+            where = {
+                "operator": "And",
+                "operands": [
+                    where,
+                    {"path": ["content_hash"], "operator": "GreaterThan", "valueText": last},
+                ],
+            }
+        objects = (
+            wv_client.query.get(SHARED_CLASS, ["content_hash"])
+            .with_additional(["id"])
+            .with_where(where)
+            .with_sort({"path": ["content_hash"], "order": "asc"})
+            .with_limit(page_size)
+            .do()["data"]["Get"][SHARED_CLASS[0].upper() + SHARED_CLASS[1:]]
+        )
+        hashes = []
+        for obj in objects:
+            existing[obj["_additional"]["id"]] = obj.get("content_hash")
+            if obj.get("content_hash"):
+                hashes.append(obj["content_hash"])
+        if len(objects) < page_size:
+            return existing
+        # Objects without a hash can't be paged past (null is never greater
+        # than anything); they only turn up before the first hash
+        if not hashes:
+            raise HTTPException(
+                status_code=500,
+                detail=f"{class_name} has more than {page_size} objects without content_hash",
+            )
+        last = max(hashes)
+
+
+def _accepts_vectors(class_schema, model):
+    # Precomputed vectors are only interchangeable with the ones Weaviate
+    # would compute if the class embeds the bare text with the same model.
+    config = class_schema.get("moduleConfig", {}).get("text2vec-cohere", {})
+    return config.get("model") == model and config.get("vectorizeClassName") is False
+
+
+def wv_sync_doc(wv_client, chunks, class_name, callback=None, metadata=None):
+    """Upload only new or changed chunks and delete the ones that are gone.
+
+    Object ids are derived from the chunk's content hash, so a chunk that is
+    already stored keeps its id (and its Cohere vector) across re-uploads.
+    In shared storage `metadata` (organization, organization_id, file,
+    shortcode) is stored on every object along with its source.
+    """
+    target = physical_class(class_name)
+    class_schema = wv_client.schema.get(target)
+    properties = class_schema.get("properties", [])
+    if not any(prop["name"] == "content_hash" for prop in properties):
+        wv_client.schema.property.create(target, CONTENT_HASH_PROPERTY)
+
+    extra = {}
+    if shared_storage():
+        extra = {**(metadata or {}), "source": class_name}
+
+    existing = wv_existing_hashes(wv_client, class_name)
+    seen = set()
+    consumed = False
+
+    def new_objects():
+        nonlocal consumed
+        for chunk in chunks:
+            digest = chunk.metadata["content_hash"]
+            uuid = generate_uuid5(digest, class_name)
+            if uuid in seen:
+                continue
+            seen.add(uuid)
+            if existing.get(uuid) == digest:
+                continue
+            yield {
+                "class_name": target,
+                "properties": {"content": chunk.page_content, "content_hash": digest, **extra},
+                "uuid": uuid,
+            }
+        consumed = True
+
+    objects = new_objects()
+    cache = get_embedding_cache()
+    if cache is not None and _accepts_vectors(class_schema, cache.model):
+        # Send our own vectors so Weaviate doesn't call Cohere for cached text
+        objects = cache.with_vectors(objects)
+
+    report = BatchImporter(wv_client, on_results=callback).run(objects)
+    if report.errors and not report.imported:
+        raise HTTPException(status_code=500, detail=f"Failed add file: {report.errors[0]['error']}")
+    if not consumed:
+        # A batch error stopped the import early: chunks that were never
+        # read would look stale, so nothing is deleted
+        raise HTTPException(
+            status_code=500, detail="Import stopped before the whole file was read"
+        )
+
+    stale = [uuid for uuid in existing if uuid not in seen]
+    for uuid in stale:
+        wv_client.data_object.delete(uuid, class_name=target)
+    added = report.imported + len(report.errors)
+    print(f"File synced: {added} added, {len(seen) - added} unchanged, {len(stale)} deleted")
+    return {
+        "added": report.imported,
+        "unchanged": len(seen) - added,
+        "deleted": len(stale),
+        "report": report,
+    }
 
 
 def wv_create_class(wv_client, class_name):
+    # In shared storage this creates the shared collection (if needed)
+    class_name = physical_class(class_name)
     class_obj = {
         "class": class_name,
         "vectorizer": "text2vec-cohere",
         "moduleConfig": {
-            "text2vec-cohere": {},
+            # Embed only the text, with the model used for cached embeddings
+            "text2vec-cohere": {
+                "model": os.environ.get("COHERE_EMBED_MODEL", "embed-multilingual-v2.0"),
+                "vectorizeClassName": False,
+            },
             "generative-cohere": {},
         },
+        "properties": [
+            {
+                "name": "content",
+                "dataType": ["text"],
+                "moduleConfig": {"text2vec-cohere": {"vectorizePropertyName": False}},
+            },
+            CONTENT_HASH_PROPERTY,
+        ],
     }
+    if shared_storage():
+        class_obj["properties"] += SHARED_PROPERTIES
 
-    wv_client.schema.create_class(class_obj)
+    try:
+        wv_client.schema.create_class(class_obj)
+    except UnexpectedStatusCodeException as e:
+        # Another worker created it since our registry was last refreshed
+        if "already exists" not in str(e):
+            raise
+        schema_registry.refresh(wv_client)
+        schema_registry.add(class_name)
+        print(f"Schema {class_name} already exists")
+        return
+    schema_registry.add(class_name)
     print(f"Schema {class_name} created successfully")
 
-def get_prompt(lang, question):
-    
-    prompts = {
+
+def wv_delete_class(wv_client, class_name):
+    if shared_storage():
+        # Each call deletes at most QUERY_MAXIMUM_RESULTS objects
+        while True:
+            results = wv_client.batch.delete_objects(
+                SHARED_CLASS, where=source_filter(class_name)
+            )["results"]
+            if not results.get("matches") or not results.get("successful"):
+                break
+    else:
+        wv_client.schema.delete_class(class_name)
+        schema_registry.discard(class_name)
+    chain_pool.invalidate(class_name)
+    print(f"Schema {class_name} deleted successfully")
+
+
+# Prompt templates per language; {question} is left for the chain's prompt
+# templates to fill in, so the same compiled chain answers every question.
+PROMPTS = {
         'eng':[
                    """
         Summarize your response in not more than 150 characters and DO NOT GO BEYOND YOUR PROVIDED DOCUMENT.
     """,
     
-    f"""IF QUESTION '{question}' IS NOT IN ENGLISH TRANSLATE IT FIRST BEFORE PROCEEDING.
+    """IF QUESTION '{question}' IS NOT IN ENGLISH TRANSLATE IT FIRST BEFORE PROCEEDING.
             
             IGNORE QUESTION '{question}' IF AND ONLY IF IT'S NOT RELATED TO THE DOCUMENT PROVIDED 
             AND SUMMARISE EVERYTHING IN NOT MORE THAN 150 CHARACTERS.
             
             RESPOND IN THE SAME LANGUAGE AS IN '{question}'
     """,
-    f"SUMMARIZE YOUR ANSWER IN NOT MORE THAN 140 CHARACTERS AND REPLY QUESTION '{question}' WITH 'I CANNOT ANSWER THIS QUESTION AS IT IS NOT RELATED TO THE CONTEXT PROVIDED' ONLY AND ONLY IF IT'S NOT RELATED TO THE DOCUMENT."
+    "SUMMARIZE YOUR ANSWER IN NOT MORE THAN 140 CHARACTERS AND REPLY TO THE QUESTION WITH 'I CANNOT ANSWER THIS QUESTION AS IT IS NOT RELATED TO THE CONTEXT PROVIDED' ONLY AND ONLY IF IT'S NOT RELATED TO THE DOCUMENT."
     
         ],
         
@@ -54,7 +471,7 @@ def get_prompt(lang, question):
     Taƙaita amsarku a cikin ba fiye da haruffa 150 ba kuma KAR KU WUCE WADANNAN TAKARDUN DA AKA BAYAR.
 """,
 
-f"""
+"""
     
     KA YI WATSAR DA TAMBAYA '{question}' IDAN KUMA IDAN TAMBAYAR BATA DA ALAKA DA TAKARDAR DA AKA BAYAR KUMA KA TAKAITA KOMAI A CIKIN BAI FIYE DA HARUFFA 150 BA.
     
@@ -64,39 +481,194 @@ f"""
 """
         ]
     }
-    
-    
-    
-    return prompts[lang]
 
 
-def ask_question(vectorstore, llm, question, chat_history, lang='hau'):
-    
-        # Define your system instruction
-    system_instruction = get_prompt(lang, question)[0]
+CONDENSE_TEMPLATE = """Rewrite the follow up question as a standalone question, using the conversation for context. Keep the language of the follow up question.
 
-    # Define your template with the system instruction
-    template = (
-        f"""
-            {system_instruction}
-            
-            {get_prompt(lang, question)[1]}
-        """
+Conversation:
+{chat_history}
+
+Follow up question: {question}
+Standalone question:"""
+
+
+def get_prompt(lang, question):
+    return [prompt.format(question=question) for prompt in PROMPTS[lang]]
+
+
+class ChainPool:
+    """Bounded LRU pool of prebuilt retrieval chains keyed by
+    (classes, lang, k, token_budget)."""
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self._chains = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, factory):
+        with self._lock:
+            chain = self._chains.get(key)
+            if chain is not None:
+                self._chains.move_to_end(key)
+                return chain
+        chain = factory()
+        with self._lock:
+            self._chains[key] = chain
+            while len(self._chains) > self.maxsize:
+                self._chains.popitem(last=False)
+        return chain
+
+    def invalidate(self, class_name):
+        with self._lock:
+            for key in [key for key in self._chains if class_name in key[0]]:
+                del self._chains[key]
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._chains), "maxsize": self.maxsize}
+
+
+chain_pool = ChainPool(int(os.environ.get("CHAIN_POOL_SIZE", 64)))
+
+
+_retrieval_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("RETRIEVAL_WORKERS", 16)),
+    thread_name_prefix="retrieval",
+)
+
+
+class MultiClassRetriever(BaseRetriever):
+    """Retrieves from every Weaviate class attached to a shortcode.
+
+    In per-file storage each class is queried concurrently and classes that
+    don't answer within `timeout` seconds are left out; in shared storage a
+    single filtered query covers all of them. Results are merged by vector
+    distance into one top `k`, then trimmed to `token_budget` tokens of the
+    most relevant passages (see utils.context.build_context). `client`
+    should come from create_retrieval_client() so that searches which time
+    out also stop.
+    """
+
+    client: Any
+    classes: List[str]
+    k: int = 4
+    timeout: float = 3.0
+    token_budget: Optional[int] = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _search(self, class_name, where, query):
+        physical = class_name if where is None else SHARED_CLASS
+        request = (
+            self.client.query.get(physical, ["content"])
+            .with_near_text({"concepts": [query]})
+            .with_additional(["distance"])
+            .with_limit(self.k)
+        )
+        if where is not None:
+            request = request.with_where(where)
+        objects = request.do()["data"]["Get"][physical[0].upper() + physical[1:]]
+        return [
+            (
+                obj["_additional"]["distance"],
+                Document(page_content=obj["content"] or "", metadata={"source": class_name}),
+            )
+            for obj in objects or []
+        ]
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        if shared_storage():
+            where = {
+                "operator": "Or",
+                "operands": [source_filter(class_name) for class_name in self.classes],
+            }
+            if len(self.classes) == 1:
+                where = source_filter(self.classes[0])
+            searches = [(self.classes[0], where)]
+        else:
+            searches = [(class_name, None) for class_name in self.classes]
+
+        futures = [
+            _retrieval_executor.submit(self._search, class_name, where, query)
+            for class_name, where in searches
+        ]
+        done, not_done = wait(futures, timeout=self.timeout)
+        if not_done:
+            # Searches still queued behind other requests are dropped; running
+            # ones end at the client's own timeout
+            for future in not_done:
+                future.cancel()
+            logging.warning(f"{len(not_done)} of {len(futures)} class searches timed out")
+        results = []
+        for future in done:
+            try:
+                results.extend(future.result())
+            except Exception as e:
+                logging.error(f"Class search failed: {e}")
+        results.sort(key=lambda result: result[0])
+        documents = [document for _, document in results[: self.k]]
+        if self.token_budget:
+            documents = build_context(query, documents, self.token_budget)
+        return documents
+
+
+def build_chain(vectorstore, llm, lang='hau', search_kwargs=None, retriever=None):
+    prompts = PROMPTS[lang]
+
+    # The answer instructions wrap the retrieved context and the question.
+    # The question only appears in its own slot, not in the instructions,
+    # and is passed on unchanged so it is also what the retriever searches
+    # for.
+    answer_prompt = PromptTemplate.from_template(
+        f"{prompts[0].strip()}\n\n{{context}}\n\nQuestion: {{question}}\n\n{prompts[2].strip()}"
     )
-    
-    # Create the prompt template
-    CONDENSEprompt = PromptTemplate.from_template(template)
+
+    # Only used for follow ups: turns the question and earlier turns into a
+    # standalone question for retrieval and the answer prompt
+    CONDENSEprompt = PromptTemplate.from_template(CONDENSE_TEMPLATE)
 
     
-    qa = ConversationalRetrievalChain.from_llm(
+    return ConversationalRetrievalChain.from_llm(
         llm,
-        vectorstore.as_retriever(),
+        retriever or vectorstore.as_retriever(search_kwargs=search_kwargs or {}),
         condense_question_prompt=CONDENSEprompt,
+        combine_docs_chain_kwargs={"prompt": answer_prompt},
     )
-    
-    appended_question = get_prompt(lang, question)[2]
 
-    result = qa({"question": appended_question, "chat_history": chat_history})
+
+def get_chain(wv_client, classes, lang='hau', k=None, token_budget=None):
+    """Pooled chain answering from all of `classes` (one name or a list).
+
+    `k` and `token_budget` default to RETRIEVAL_K and CONTEXT_TOKENS.
+    """
+    if isinstance(classes, str):
+        classes = [classes]
+    classes = tuple(sorted(set(classes)))
+    k = k or int(os.environ.get("RETRIEVAL_K", 4))
+    token_budget = token_budget or int(os.environ.get("CONTEXT_TOKENS", 600))
+    return chain_pool.get(
+        (classes, lang, k, token_budget),
+        lambda: build_chain(
+            None,
+            Cohere(temperature=0),
+            lang,
+            retriever=MultiClassRetriever(
+                client=wv_client,
+                classes=list(classes),
+                k=k,
+                timeout=retrieval_timeout(),
+                token_budget=token_budget,
+            ),
+        ),
+    )
+
+
+def run_chain(qa, question, chat_history):
+    result = qa({"question": question, "chat_history": chat_history})
     chat_history.append((question, result["answer"]))
-    qa = None
     return result["answer"]
+
+
+def ask_question(vectorstore, llm, question, chat_history, lang='hau'):
+    return run_chain(build_chain(vectorstore, llm, lang), question, chat_history)